@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+
+from core.config import load_config
+from core.db_utils import init_db_pool, close_pool
+from core.engine import FaceEngine
+from core.gallery import normalize_rows
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+VIDEO_EXTS = {".mp4", ".avi", ".mkv", ".mov", ".webm", ".m4v"}
+FIELDS = ["source", "frame", "face", "x1", "y1", "x2", "y2", "state", "id", "name", "dist"]
+
+_END = object()
+
+
+def iter_images(paths, workers):
+    """Dekodowanie obrazów w puli wątków, kolejność zachowana."""
+    chunk = max(1, workers) * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # porcjami, żeby nie trzymać w pamięci całego zdekodowanego katalogu
+        for i in range(0, len(paths), chunk):
+            part = paths[i:i + chunk]
+            for path, frame in zip(part, pool.map(cv2.imread, [str(p) for p in part])):
+                if frame is not None:
+                    yield str(path), 0, frame
+
+
+def iter_video(path, stride):
+    cap = cv2.VideoCapture(str(path))
+    idx = 0
+    try:
+        while True:
+            if not cap.grab():
+                break
+            if idx % stride == 0:
+                ret, frame = cap.retrieve()
+                if ret:
+                    yield str(path), idx, frame
+            idx += 1
+    finally:
+        cap.release()
+
+
+def iter_inputs(inputs, workers, stride):
+    for inp in inputs:
+        p = Path(inp)
+        if p.is_dir():
+            yield from iter_images(sorted(f for f in p.rglob("*") if f.suffix.lower() in IMAGE_EXTS), workers)
+        elif p.suffix.lower() in VIDEO_EXTS:
+            yield from iter_video(p, stride)
+        elif p.suffix.lower() in IMAGE_EXTS:
+            yield from iter_images([p], 1)
+        else:
+            print(f"Pomijam nieobsługiwane wejście: {inp}", file=sys.stderr)
+
+
+def prefetch(gen, size):
+    """Dekodowanie w tle - ograniczona kolejka między dekoderem a detekcją."""
+    q = queue.Queue(maxsize=size)
+
+    def fill():
+        try:
+            for item in gen:
+                q.put(item)
+        finally:
+            q.put(_END)
+
+    threading.Thread(target=fill, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is _END:
+            return
+        yield item
+
+
+def batched(gen, size):
+    batch = []
+    for item in gen:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ResultWriter:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, "w", encoding="utf-8", newline="")
+        self.jsonl = self.path.suffix.lower() in (".jsonl", ".json")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.f, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row: dict):
+        if self.jsonl:
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            self.writer.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+
+def process_batch(engine, batch, pool):
+    """Detekcja klatek z paczki w puli, embeddingi wszystkich twarzy paczki jednym tensorem,
+    potem jedno dopasowanie macierz-macierz."""
+    faces_per_frame = list(pool.map(engine.locate, [frame for _, _, frame in batch]))
+    meta, pairs = [], []
+    for (source, idx, frame), faces in zip(batch, faces_per_frame):
+        if not faces:
+            meta.append((source, idx, None, None))
+        for fi, face in enumerate(faces):
+            meta.append((source, idx, fi, face.bbox.astype(int)))
+            pairs.append((frame, face))
+    embs = engine.embed_faces(pairs)
+    matches = iter(engine.match_batch(normalize_rows(embs)) if pairs else [])
+
+    rows = []
+    for source, idx, fi, bbox in meta:
+        row = dict.fromkeys(FIELDS)
+        row.update(source=source, frame=idx, face=fi)
+        if bbox is None:
+            row["state"] = 0
+        else:
+            state, cid, dist = engine.classify(*next(matches))
+            row.update(x1=int(bbox[0]), y1=int(bbox[1]), x2=int(bbox[2]), y2=int(bbox[3]),
+                       state=state, id=cid, name=engine.id_to_name.get(cid) if cid else None,
+                       dist=round(dist, 4) if dist is not None else None)
+        rows.append(row)
+    return rows
+
+
+def run(engine, inputs, out, batch_size=16, workers=4, stride=1):
+    writer = ResultWriter(out)
+    frames = 0
+    start = last_report = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            source = prefetch(iter_inputs(inputs, workers, stride), size=batch_size * 2)
+            for batch in batched(source, batch_size):
+                for row in process_batch(engine, batch, pool):
+                    writer.write(row)
+                frames += len(batch)
+                now = time.perf_counter()
+                if now - last_report >= 5.0:
+                    last_report = now
+                    print(f"{frames} frames, {frames / (now - start):.1f} fps", file=sys.stderr)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {frames} frames in {elapsed:.1f}s ({fps:.1f} fps) -> {out}", file=sys.stderr)
+    return frames, fps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FACEID - rozpoznawanie offline z folderów zdjęć i plików wideo")
+    parser.add_argument("inputs", nargs="+", help="katalogi ze zdjęciami, pliki wideo lub zdjęcia")
+    parser.add_argument("-o", "--out", default="results.csv", help="plik wynikowy .csv lub .jsonl")
+    parser.add_argument("-b", "--batch", type=int, default=16, help="liczba klatek w paczce")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="wątki dekodowania i detekcji")
+    parser.add_argument("--stride", type=int, default=1, help="co która klatka wideo")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config = load_config()
+    init_db_pool(minconn=1, maxconn=2, dsn=config["db_conn"])
+    try:
+        engine = FaceEngine(
+            embeddings_dir=config["paths"]["embeddings"],
+            threshold=config["threshold"],
+            index_cfg=config["index"],
+            model_cfg=config["models"],
+            runtime_cfg=config["runtime"]
+        )
+        run(engine, args.inputs, args.out, args.batch, args.workers, max(1, args.stride))
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from core.db_utils import update_attendance_times
+
+log = logging.getLogger("faceid.attendance")
+
+class AttendanceTracker:
+    """Decyduje per osoba, kiedy zapisać obecność: gdy pojawia się w kadrze pierwszy raz
+    albo po co najmniej `cooldown` s od zniknięcia (obsługuje wiele twarzy w klatce)."""
+
+    def __init__(self, cooldown: int):
+        self.cooldown = cooldown
+        self.present = set()
+        self.left_at = {}
+
+    def update(self, recognized_ids, now: float = None) -> list:
+        now = time.time() if now is None else now
+        seen = set(recognized_ids)
+        for pid in self.present - seen:
+            self.left_at[pid] = now
+        to_write = [
+            pid for pid in seen - self.present
+            if pid not in self.left_at or now - self.left_at[pid] >= self.cooldown
+        ]
+        for pid in seen:
+            self.left_at.pop(pid, None)
+        self.present = seen
+        # nie trzymamy w nieskończoność osób, których cooldown już minął
+        self.left_at = {pid: t for pid, t in self.left_at.items() if now - t < self.cooldown}
+        return to_write
+
+
+class AttendanceWriter:
+    """Zapis obecności w tle: łączy aktualizacje per osoba i co `flush_interval` s
+    wysyła je jedną paczką; gdy baza nie odpowiada, odkłada je do pliku `spill_file`."""
+
+    def __init__(self, flush_interval: float = 1.0, max_retries: int = 3,
+                 retry_delay: float = 0.5, spill_file: str = "attendance_spill.jsonl"):
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.spill_file = Path(spill_file) if spill_file else None
+
+        self._pending = {}  # pid -> najnowszy czas obecności
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.spilled = 0
+
+    def start(self):
+        self._load_spill()
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, pid: str, ts: datetime = None) -> datetime:
+        ts = ts or datetime.now(timezone.utc)
+        with self._lock:
+            prev = self._pending.get(pid)
+            if prev is None or ts > prev:
+                self._pending[pid] = ts
+        return ts
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = list(self._pending.items()), {}
+        if not rows:
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                update_attendance_times(rows)
+                self.written += len(rows)
+                self._load_spill()
+                return
+            except Exception as e:
+                log.warning("attendance flush failed (%d/%d): %s", attempt + 1, self.max_retries + 1, e)
+                if attempt < self.max_retries and not self._stop.is_set():
+                    time.sleep(self.retry_delay * (2 ** attempt))
+        self._spill(rows)
+
+    def _spill(self, rows):
+        if not self.spill_file:
+            log.error("dropping %d attendance updates", len(rows))
+            return
+        with open(self.spill_file, "a", encoding="utf-8") as f:
+            for pid, ts in rows:
+                f.write(json.dumps({"id": pid, "ts": ts.isoformat()}) + "\n")
+        self.spilled += len(rows)
+
+    def _load_spill(self):
+        # zaległe wpisy z poprzednich awarii wracają do kolejki
+        if not self.spill_file or not self.spill_file.exists():
+            return
+        lines = self.spill_file.read_text(encoding="utf-8").splitlines()
+        self.spill_file.unlink()
+        for line in lines:
+            try:
+                rec = json.loads(line)
+                self.submit(rec["id"], datetime.fromisoformat(rec["ts"]))
+            except (ValueError, KeyError):
+                continue
+
+
+
@@ -1,23 +1,121 @@
 import cv2
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("faceid.camera")
 
 class CameraHandler:
-    def __init__(self, cam_index=0, width=640, height=480):
+    def __init__(self, cam_index=0, width=640, height=480, threaded=False, buffer_size=1,
+                 max_failures: int = 50, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
         self.cam_index = cam_index
         self.width = width
         self.height = height
         self.cap = None
 
+        # tryb wątkowy: osobny wątek czyta kamerę, trzymamy tylko najnowsze klatki
+        self.threaded = threaded
+        self._buffer = deque(maxlen=max(1, buffer_size))  # (seq, ts, frame)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._thread = None
+        self._stop = None
+        # utrata źródła w trybie wątkowym: po max_failures nieudanych odczytach ponowne
+        # otwarcie z rosnącym odstępem (reconnect_delay .. max_reconnect_delay)
+        self.max_failures = max_failures
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+    def _open_capture(self):
+        cap = cv2.VideoCapture(self.cam_index)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.threaded:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     def open(self):
-        self.cap = cv2.VideoCapture(self.cam_index)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.cap = self._open_capture()
+        if self.threaded:
+            # wątek jest jedynym właścicielem uchwytu; własne zdarzenie stop na każde otwarcie,
+            # więc spóźniony stary wątek nie wznowi pracy po ponownym open()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._capture_loop, args=(self.cap, self._stop), daemon=True)
+            self._thread.start()
+
+    def _reconnect(self, cap, stop):
+        delay = self.reconnect_delay
+        log.warning("source %s lost, reconnecting", self.cam_index)
+        cap.release()
+        while not stop.wait(delay):
+            cap = self._open_capture()
+            if stop.is_set():
+                return cap  # close() w trakcie otwierania - zwolni go finally w pętli
+            if cap.isOpened():
+                log.info("source %s reconnected", self.cam_index)
+                return cap
+            cap.release()
+            delay = min(delay * 2, self.max_reconnect_delay)
+            log.warning("source %s still unavailable, next attempt in %.1fs", self.cam_index, delay)
+        return None
+
+    def _capture_loop(self, cap, stop):
+        failures = 0
+        try:
+            while not stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    failures += 1
+                    if failures >= self.max_failures:
+                        failures = 0
+                        cap = self._reconnect(cap, stop)
+                        if cap is None:
+                            return
+                    else:
+                        time.sleep(0.01)
+                    continue
+                failures = 0
+                # każda klatka to nowy bufor; po publikacji nikt go nie zmienia,
+                # więc podgląd i rozpoznawanie mogą dzielić go bez kopiowania
+                frame.setflags(write=False)
+                with self._lock:
+                    self._seq += 1
+                    self._buffer.append((self._seq, time.time(), frame))
+        finally:
+            # także uchwyt otwarty w trakcie ponownego łączenia, już po close()
+            if cap is not None:
+                cap.release()
+
+    def latest(self):
+        """Nieblokująco: (ret, frame, ts, seq) najnowszej klatki."""
+        with self._lock:
+            if not self._buffer:
+                return False, None, 0.0, 0
+            seq, ts, frame = self._buffer[-1]
+        return True, frame, ts, seq
+
+    def frames(self):
+        with self._lock:
+            return list(self._buffer)
 
     def read(self):
         if not self.cap:
             return False, None
+        if self.threaded:
+            ret, frame, _, _ = self.latest()
+            return ret, frame
         return self.cap.read()
 
-    def close(self):
-        if self.cap:
+    def close(self, timeout: float = 5.0):
+        if self._thread:
+            self._stop.set()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                log.warning("capture thread of %s still busy, it releases the source on exit", self.cam_index)
+            self._thread = None
+        elif self.cap:
             self.cap.release()
-            self.cap = None
+        self.cap = None
+        with self._lock:
+            self._buffer.clear()
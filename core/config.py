@@ -10,16 +10,94 @@ DEFAULT_CONFIG = {
         "embeddings": "embeddings/",
         "sample": "sample/"
     },
-    "threshold": 1.07
+    "threshold": 1.07,
+    "models": {
+        "name": "buffalo_l",
+        "allowed_modules": ["detection", "recognition"],
+        "det_size": 640,
+        "adaptive_det": {
+            "enabled": False,
+            "sizes": [256, 320, 640],
+            "min_face_px": 48,
+            "history": 5
+        },
+        "roi_tracking": {
+            "enabled": False,
+            "expand": 2.0,
+            "full_every": 15,
+            "det_size": 320,
+            "max_area": 0.5
+        },
+        "identity_cache": {
+            "enabled": False,
+            "refresh_every": 10,
+            "iou": 0.5,
+            "max_score_drop": 0.1,
+            "max_scale_change": 0.25,
+            "max_pose_change": 0.15
+        },
+        "batch_embed": {
+            "max_batch": 32,
+            "deadline_ms": 0
+        }
+    },
+    "runtime": {
+        "providers": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+        "ctx_id": 0,
+        "intra_op_threads": 0,
+        "inter_op_threads": 0,
+        "execution_mode": "sequential",
+        "graph_optimization": "all",
+        "cpu_mem_arena": True,
+        "mem_pattern": True
+    },
+    "index": {
+        "type": "flat",
+        "nlist": 0,
+        "nprobe": 8,
+        "train_iters": 10,
+        "prototypes": 1,
+        "top_n": 8,
+        "persist": True
+    },
+    "headless": {
+        "sources": [0],
+        "width": 1280,
+        "height": 960,
+        "interval_ms": 10,
+        "cooldown": 30,
+        "log_file": ""
+    },
+    "attendance": {
+        "flush_interval": 1.0,
+        "max_retries": 3,
+        "retry_delay": 0.5,
+        "spill_file": "attendance_spill.jsonl"
+    },
+    "photo_cache": {
+        "max_mb": 64,
+        "prefetch": True
+    },
+    "watcher": {
+        "enabled": False,
+        "interval": 2.0,
+        "backend": "auto"
+    }
 }
 
 def save_config(cfg: dict):
     with open(CONFIG_PATH, "w", encoding="utf-8") as f:
         json.dump(cfg, f, indent=2, ensure_ascii=False)
 
+def _same_type(default, value) -> bool:
+    # liczba całkowita w config.json tam, gdzie domyślna jest float ("interval": 5), jest poprawna
+    if isinstance(default, float) and isinstance(value, int) and not isinstance(value, bool):
+        return True
+    return isinstance(value, type(default))
+
 def merge_defaults(default: dict, current: dict):
     for key, val in default.items():
-        if key not in current or not isinstance(current[key], type(val)):
+        if key not in current or not _same_type(val, current[key]):
             current[key] = val
         elif isinstance(val, dict):
             merge_defaults(val, current[key])
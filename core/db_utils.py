@@ -1,6 +1,7 @@
 from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 import psycopg2
+from psycopg2.extras import execute_batch
 from datetime import datetime, timezone
 
 _db_pool = None
@@ -68,4 +69,24 @@ def create_person(person_id: str, name: str, last_attendance: datetime):
             )
         conn.commit()
     finally:
-        _db_pool.putconn(conn)
\ No newline at end of file
+        _db_pool.putconn(conn)
+
+def update_attendance_times(rows):
+    """rows: [(pid, datetime)] - jedna transakcja, zapytania wysłane paczką.
+
+    Czas tylko rośnie: odtworzony z pliku spill starszy wpis nie nadpisze nowszego."""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            execute_batch(
+                cur,
+                "UPDATE persons SET last_attendance_time = "
+                "GREATEST(COALESCE(last_attendance_time, %s), %s) WHERE id = %s;",
+                [(ts, ts, pid) for pid, ts in rows]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_conn(conn)
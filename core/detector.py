@@ -0,0 +1,192 @@
+import numpy as np
+from collections import deque
+
+class AdaptiveDetSize:
+    """Dobiera rozmiar wejścia detektora do klatki na podstawie ostatnich detekcji.
+
+    Duża twarz (kiosk) -> najmniejszy rozmiar, przy którym najmniejsza twarz z ostatnich
+    `history` klatek ma co najmniej `min_face_px` pikseli na wejściu detektora.
+    Brak twarzy -> największy rozmiar.
+    """
+
+    def __init__(self, sizes=(256, 320, 640), min_face_px: int = 48, history: int = 5):
+        self.sizes = sorted(sizes)
+        self.max_size = self.sizes[-1]
+        self.min_face_px = min_face_px
+        self._recent = deque(maxlen=max(1, history))  # względny rozmiar najmniejszej twarzy
+        self.size = self.max_size
+
+    def next_size(self) -> int:
+        return self.size
+
+    def update(self, faces, frame_shape):
+        if not faces:
+            self._recent.clear()
+            self.size = self.max_size
+            return
+        longest = max(frame_shape[:2])
+        rel = min(min(f.bbox[2] - f.bbox[0], f.bbox[3] - f.bbox[1]) for f in faces) / longest
+        self._recent.append(rel)
+        smallest = min(self._recent)
+        # detektor skaluje klatkę tak, by dłuższy bok = size
+        self.size = next((s for s in self.sizes if smallest * s >= self.min_face_px), self.max_size)
+
+
+class RoiTracker:
+    """Między pełnymi detekcjami szuka twarzy tylko w powiększonym obszarze wokół ostatnich bboxów.
+
+    Pełna klatka co `full_every` klatek, gdy w ROI nic nie znaleziono albo gdy ROI
+    (obejmujące wszystkie twarze) zajmuje więcej niż `max_area` klatki - wtedy mniejsze
+    wejście detektora nic nie oszczędza, a gubi małe twarze.
+    """
+
+    def __init__(self, expand: float = 2.0, full_every: int = 15, det_size: int = 320,
+                 max_area: float = 0.5):
+        self.expand = expand
+        self.full_every = full_every
+        self.det_size = det_size
+        self.max_area = max_area
+        self.box = None
+        self.since_full = 0
+
+    def roi(self, frame_shape):
+        if self.box is None or self.since_full >= self.full_every:
+            return None
+        h, w = frame_shape[:2]
+        x1, y1, x2, y2 = self.box
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        half = max(x2 - x1, y2 - y1) * self.expand / 2
+        rx1, ry1 = max(0, int(cx - half)), max(0, int(cy - half))
+        rx2, ry2 = min(w, int(cx + half)), min(h, int(cy + half))
+        if rx2 - rx1 < 16 or ry2 - ry1 < 16:
+            return None
+        if (rx2 - rx1) * (ry2 - ry1) > self.max_area * w * h:
+            return None
+        return rx1, ry1, rx2, ry2
+
+    def update(self, faces, full: bool):
+        self.since_full = 0 if full else self.since_full + 1
+        if not faces:
+            self.box = None
+            return
+        boxes = [f.bbox for f in faces]
+        self.box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                    max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def iou(a, b) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def pose_proxy(kps):
+    """Przybliżone odchylenie/pochylenie głowy z 5 punktów: nos względem środka oczu."""
+    if kps is None:
+        return None
+    eyes = (kps[0] + kps[1]) / 2
+    eye_dist = np.linalg.norm(kps[1] - kps[0]) or 1.0
+    return (kps[2] - eyes) / eye_dist
+
+
+class Track:
+    __slots__ = ("bbox", "det_score", "size", "pose", "embedding", "match", "version", "age")
+
+    def __init__(self, face):
+        self.bbox = face.bbox
+        self.det_score = float(face.det_score or 0.0)
+        self.size = float(face.bbox[2] - face.bbox[0])
+        self.pose = pose_proxy(face.kps)
+        self.embedding = None
+        self.match = None  # (id, dist) tylko po pewnym rozpoznaniu
+        self.version = None  # wersja galerii, z którą dopasowano
+        self.age = 0
+
+    def remember(self, state: int, cid, dist, version=None):
+        self.match = (cid, dist) if state == 1 else None
+        self.version = version
+
+
+class IdentityCache:
+    """Embedding i tożsamość per ślad (IoU między klatkami).
+
+    Pewnie rozpoznany ślad nie jest ponownie embedowany ani dopasowywany, dopóki nie minie
+    `refresh_every` klatek, nie zmieni się istotnie jakość (det_score, skala, poza)
+    albo nie zmieni się galeria (dodanie / usunięcie osoby).
+    """
+
+    def __init__(self, refresh_every: int = 10, iou_thresh: float = 0.5, max_score_drop: float = 0.1,
+                 max_scale_change: float = 0.25, max_pose_change: float = 0.15):
+        self.refresh_every = refresh_every
+        self.iou_thresh = iou_thresh
+        self.max_score_drop = max_score_drop
+        self.max_scale_change = max_scale_change
+        self.max_pose_change = max_pose_change
+        self.tracks = []
+        self.hits = 0
+        self.misses = 0
+
+    def _associate(self, face, used):
+        best, best_iou = None, self.iou_thresh
+        for t in self.tracks:
+            if id(t) in used:
+                continue
+            v = iou(t.bbox, face.bbox)
+            if v >= best_iou:
+                best, best_iou = t, v
+        return best
+
+    def _fresh(self, t: Track, face, version) -> bool:
+        if t.match is None or t.embedding is None or t.age >= self.refresh_every:
+            return False
+        if t.version != version:
+            return False
+        if t.det_score - float(face.det_score or 0.0) > self.max_score_drop:
+            return False
+        if abs(float(face.bbox[2] - face.bbox[0]) / (t.size or 1.0) - 1.0) > self.max_scale_change:
+            return False
+        pose = pose_proxy(face.kps)
+        if t.pose is not None and pose is not None and np.abs(pose - t.pose).max() > self.max_pose_change:
+            return False
+        return True
+
+    def resolve(self, faces, embed, version=None):
+        """Uzupełnia face.embedding (z pamięci albo przez embed(lista twarzy) - jedną paczką) i podpina face.track."""
+        matched, todo, used = [], [], set()
+        for face in faces:
+            t = self._associate(face, used)
+            if t is not None and self._fresh(t, face, version):
+                t.age += 1
+                t.bbox = face.bbox
+                face.embedding = t.embedding
+                face.cached_match = t.match
+                used.add(id(t))
+                self.hits += 1
+            else:
+                todo.append(face)
+                t = None
+                self.misses += 1
+            matched.append(t)
+        if todo:
+            embed(todo)
+        tracks = []
+        for face, t in zip(faces, matched):
+            if t is None:
+                t = Track(face)
+                t.embedding = face.embedding
+            face.track = t
+            tracks.append(t)
+        self.tracks = tracks
+        return faces
+
+
+class StreamState:
+    """Stan jednego strumienia klatek (kamera, plik) trzymany poza współdzielonym FaceEngine."""
+
+    def __init__(self, det_size: AdaptiveDetSize = None, tracker: RoiTracker = None,
+                 cache: IdentityCache = None):
+        self.det_size = det_size
+        self.tracker = tracker
+        self.cache = cache
@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+log = logging.getLogger("faceid.embedder")
+
+_STOP = object()
+
+
+def run_chunked(run, crops, max_batch: int) -> np.ndarray:
+    """run(lista wycinków) -> (n, D); wywołania po co najwyżej max_batch wycinków."""
+    if not crops:
+        return np.empty((0, 0), dtype=np.float32)
+    step = max(1, max_batch)
+    return np.concatenate([run(crops[i:i + step]) for i in range(0, len(crops), step)])
+
+
+class BatchEmbedder:
+    """Zbiera wycinki twarzy z wielu wywołań (wątków) i uruchamia model jedną paczką.
+
+    Paczka rusza, gdy uzbiera się `max_batch` wycinków albo minie `deadline_ms`
+    od pierwszego oczekującego zgłoszenia. Każdy dostaje embeddingi w kolejności swoich wycinków.
+    """
+
+    def __init__(self, run, max_batch: int = 32, deadline_ms: float = 5.0):
+        self.run = run
+        self.max_batch = max(1, max_batch)
+        self.deadline = deadline_ms / 1000.0
+        self.batches = 0
+        self.crops = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="batch-embedder", daemon=True)
+        self._thread.start()
+
+    def embed(self, crops) -> np.ndarray:
+        if not crops:
+            return np.empty((0, 0), dtype=np.float32)
+        fut = Future()
+        self._queue.put((list(crops), fut))
+        return fut.result()
+
+    def stop(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        items, n = [first], len(first[0])
+        until = time.monotonic() + self.deadline
+        while n < self.max_batch:
+            timeout = until - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            items.append(item)
+            n += len(item[0])
+        return items
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            items = self._collect(first)
+            crops = [c for cs, _ in items for c in cs]
+            try:
+                feats = run_chunked(self.run, crops, self.max_batch)
+            except Exception as e:
+                log.exception("batched embedding failed")
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.crops += len(crops)
+            start = 0
+            for cs, fut in items:
+                fut.set_result(feats[start:start + len(cs)])
+                start += len(cs)
@@ -1,59 +1,432 @@
+import glob
+import logging
+import os.path as osp
+import threading
 import numpy as np
-from pathlib import Path
-from insightface.app import FaceAnalysis
+import onnx
+import onnxruntime as ort
+from insightface.app.common import Face
+from insightface.model_zoo import SCRFD, ArcFaceONNX, Landmark, Attribute
+from insightface.utils import ensure_available
+from insightface.utils import face_align
 from core.db_utils import get_all_users
+from core import gallery
+from core.index import make_index, index_path, DEFAULT_INDEX_CFG
+from core.detector import AdaptiveDetSize, RoiTracker, IdentityCache, StreamState
+from core.embedder import BatchEmbedder, run_chunked
+
+DEFAULT_MODEL_CFG = {
+    "name": "buffalo_l",
+    # FACEID używa tylko bbox/kps z detektora i embeddingu; landmarki 2d/3d i genderage są pomijane
+    "allowed_modules": ["detection", "recognition"],
+    "det_size": 640,
+    # tryb adaptacyjny: mniejsze wejście detektora, gdy twarze są duże
+    "adaptive_det": {
+        "enabled": False,
+        "sizes": [256, 320, 640],
+        "min_face_px": 48,
+        "history": 5
+    },
+    # śledzenie ROI: detekcja tylko wokół ostatniej twarzy, pełna klatka co full_every
+    # albo gdy ROI zajmuje więcej niż max_area klatki (np. dwie osoby daleko od siebie)
+    "roi_tracking": {
+        "enabled": False,
+        "expand": 2.0,
+        "full_every": 15,
+        "det_size": 320,
+        "max_area": 0.5
+    },
+    # pamięć tożsamości per ślad: embedding i dopasowanie tylko co refresh_every klatek
+    "identity_cache": {
+        "enabled": False,
+        "refresh_every": 10,
+        "iou": 0.5,
+        "max_score_drop": 0.1,
+        "max_scale_change": 0.25,
+        "max_pose_change": 0.15
+    },
+    # rozpoznawanie wszystkich twarzy z klatki (lub paczki klatek) jednym tensorem;
+    # deadline_ms > 0 łączy też wywołania z różnych wątków w jedną paczkę
+    "batch_embed": {
+        "max_batch": 32,
+        "deadline_ms": 0
+    }
+}
+
+DEFAULT_RUNTIME_CFG = {
+    "providers": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+    "ctx_id": 0,
+    "intra_op_threads": 0,          # 0 = domyślnie ONNX Runtime
+    "inter_op_threads": 0,
+    "execution_mode": "sequential", # sequential | parallel
+    "graph_optimization": "all",    # disable | basic | extended | all
+    "cpu_mem_arena": True,
+    "mem_pattern": True
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+log = logging.getLogger("faceid.engine")
+
+class FaceMatch:
+    """Wynik rozpoznania jednej twarzy w klatce."""
+    __slots__ = ("bbox", "state", "id", "dist")
+
+    def __init__(self, bbox, state: int, pid, dist):
+        self.bbox = bbox
+        self.state = state
+        self.id = pid
+        self.dist = dist
+
+    @property
+    def area(self) -> float:
+        return float((self.bbox[2] - self.bbox[0]) * (self.bbox[3] - self.bbox[1]))
+
+def largest_face(faces):
+    return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+
+def make_session_options(cfg: dict) -> ort.SessionOptions:
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = cfg["intra_op_threads"]
+    so.inter_op_num_threads = cfg["inter_op_threads"]
+    so.execution_mode = EXECUTION_MODES[cfg["execution_mode"]]
+    so.graph_optimization_level = GRAPH_OPTIMIZATION[cfg["graph_optimization"]]
+    so.enable_cpu_mem_arena = cfg["cpu_mem_arena"]
+    so.enable_mem_pattern = cfg["mem_pattern"]
+    return so
+
+def select_providers(wanted) -> list:
+    available = set(ort.get_available_providers())
+    return [p for p in wanted if p in available] or ["CPUExecutionProvider"]
+
+def _dims(value_info) -> list:
+    return [d.dim_value if d.HasField("dim_value") else None for d in value_info.type.tensor_type.shape.dim]
+
+def model_task(onnx_file: str):
+    """(taskname, klasa) z kształtów wejścia/wyjścia grafu ONNX, jak ModelRouter w insightface,
+    ale bez tworzenia sesji - niepotrzebne modele nie są w ogóle ładowane do ONNX Runtime."""
+    graph = onnx.load(onnx_file, load_external_data=False).graph
+    weights = {init.name for init in graph.initializer}
+    inputs = [i for i in graph.input if i.name not in weights]
+    shape, out = _dims(inputs[0]), _dims(graph.output[0])
+    if len(graph.output) >= 5:
+        return "detection", SCRFD
+    if shape[2] == 192 and shape[3] == 192:
+        dim, num = (3, 68) if out[1] == 3309 else (2, (out[1] or 0) // 2)
+        return f"landmark_{dim}d_{num}", Landmark
+    if shape[2] == 96 and shape[3] == 96:
+        return ("genderage" if out[1] == 3 else f"attribute_{out[1]}"), Attribute
+    if shape[2] == shape[3] and shape[2] and shape[2] >= 112 and shape[2] % 16 == 0:
+        return "recognition", ArcFaceONNX
+    return None, None
+
+def load_models(name: str, allowed_modules, sess_options: ort.SessionOptions, providers,
+                root: str = "~/.insightface") -> dict:
+    """Modele z paczki insightface, każdy z jedną sesją utworzoną od razu z naszymi SessionOptions.
+
+    FaceAnalysis nie przekazuje SessionOptions do model_zoo, a podmiana sesji po fakcie
+    ładowała i optymalizowała każdy model dwa razy. Sesje powstają tylko dla allowed_modules.
+    """
+    model_dir = ensure_available("models", name, root=root)
+    models = {}
+    for onnx_file in sorted(glob.glob(osp.join(model_dir, "*.onnx"))):
+        task, cls = model_task(onnx_file)
+        if task is None or task in models:
+            continue
+        if allowed_modules and task not in allowed_modules:
+            log.info("skipping %s (%s)", osp.basename(onnx_file), task)
+            continue
+        session = ort.InferenceSession(onnx_file, sess_options=sess_options, providers=providers)
+        models[task] = cls(model_file=onnx_file, session=session)
+    if "detection" not in models:
+        raise RuntimeError(f"Brak modelu detekcji w paczce {name}")
+    return models
 
 class FaceEngine:
-    def __init__(self, embeddings_dir: str, threshold: float):
-        self.face_analyzer = FaceAnalysis(
-            name='buffalo_l',
-            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+    def __init__(self, embeddings_dir: str, threshold: float, index_cfg: dict = None,
+                 model_cfg: dict = None, runtime_cfg: dict = None):
+        self.model_cfg = {**DEFAULT_MODEL_CFG, **(model_cfg or {})}
+        self.runtime_cfg = {**DEFAULT_RUNTIME_CFG, **(runtime_cfg or {})}
+        providers = select_providers(self.runtime_cfg["providers"])
+        self.models = load_models(self.model_cfg["name"], self.model_cfg["allowed_modules"],
+                                  make_session_options(self.runtime_cfg), providers)
+        self.det_model = self.models["detection"]
+        det = self.model_cfg["det_size"]
+        # jak FaceAnalysis.prepare
+        for taskname, model in self.models.items():
+            if taskname == "detection":
+                model.prepare(self.runtime_cfg["ctx_id"], input_size=(det, det), det_thresh=0.5)
+            else:
+                model.prepare(self.runtime_cfg["ctx_id"])
+        rc = self.runtime_cfg
+        log.info(
+            "onnxruntime: providers=%s intra_op=%d inter_op=%d mode=%s opt=%s mem_arena=%s mem_pattern=%s models=%s",
+            providers, rc["intra_op_threads"], rc["inter_op_threads"], rc["execution_mode"],
+            rc["graph_optimization"], rc["cpu_mem_arena"], rc["mem_pattern"],
+            sorted(self.models)
         )
-        self.face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+
+        bcfg = {**DEFAULT_MODEL_CFG["batch_embed"], **self.model_cfg.get("batch_embed", {})}
+        self.rec_model = self.models.get("recognition")
+        self.max_batch = max(1, bcfg["max_batch"])
+        if self.rec_model is not None:
+            fixed = self.rec_model.session.get_inputs()[0].shape[0]
+            if isinstance(fixed, int) and fixed > 0:
+                # model wyeksportowany ze stałym rozmiarem paczki
+                self.max_batch = min(self.max_batch, fixed)
+        self.embedder = None
+        if self.rec_model is not None and bcfg["deadline_ms"] > 0:
+            self.embedder = BatchEmbedder(self.rec_model.get_feat, self.max_batch, bcfg["deadline_ms"])
+        log.info("recognition batching: max_batch=%d deadline_ms=%s", self.max_batch, bcfg["deadline_ms"])
 
         self.threshold = threshold
 
+        # cała galeria jako jedna macierz (N, D) + id osoby dla każdego wiersza
         self.embeddings_map = {}
+        self.gallery = np.empty((0, 512), dtype=np.float32)
+        self.gallery_ids = np.empty(0, dtype=object)
         self._load_embeddings(embeddings_dir)
+        # bufory z zapasem pod dopisywanie osób bez kopiowania całej galerii
+        self._buf, self._ids_buf = None, None
+        self._lock = threading.RLock()
+        # rośnie przy każdej zmianie galerii; wynik z pamięci śladu ze starszej wersji jest nieważny
+        self.gallery_version = 0
+
+        self.embeddings_dir = embeddings_dir
+        self.index_cfg = {**DEFAULT_INDEX_CFG, **(index_cfg or {})}
+        self.index = make_index(self.index_cfg)
+        self._build_index()
 
         self.id_to_name = {}
         self._load_user_data()
 
     def _load_embeddings(self, embeddings_dir: str):
-        base = Path(embeddings_dir)
-        for pid_dir in base.iterdir():
-            if not pid_dir.is_dir(): continue
-            vecs = []
-            for npf in pid_dir.glob('*.npy'):
-                v = np.load(npf).astype(np.float32)
-                n = np.linalg.norm(v)
-                if n > 0:
-                    vecs.append(v / n)
-            if vecs:
-                self.embeddings_map[pid_dir.name] = vecs
+        packed = gallery.gallery_path(embeddings_dir)
+        if packed.exists():
+            try:
+                matrix, ids = gallery.load_gallery(packed)
+            except (ValueError, OSError) as e:
+                # to tylko pochodna katalogów osób - uszkodzony plik budujemy od nowa
+                log.warning("packed gallery %s is unreadable (%s), rebuilding from %s", packed, e, embeddings_dir)
+            else:
+                if not gallery.is_stale(packed, embeddings_dir, ids):
+                    self.gallery, self.gallery_ids = matrix, ids
+                    self.embeddings_map = gallery.group_rows(matrix, ids)
+                    return
+                log.warning("packed gallery %s is stale, rebuilding from %s", packed, embeddings_dir)
+        # układ katalogowy jako źródło zapasowe; wynik od razu pakujemy, żeby kolejny start był szybki
+        self.embeddings_map = gallery.load_embeddings_dir(embeddings_dir)
+        matrix, ids = gallery.flatten(self.embeddings_map)
+        try:
+            gallery.save_gallery(packed, matrix, ids)
+        except OSError as e:
+            log.warning("cannot write packed gallery %s: %s", packed, e)
+            self.gallery, self.gallery_ids = matrix, ids
+            return
+        self.gallery, self.gallery_ids = gallery.load_gallery(packed)
+        self.embeddings_map = gallery.group_rows(self.gallery, self.gallery_ids)
+
+    def _build_index(self):
+        path = index_path(self.embeddings_dir, self.index.kind)
+        persist = self.index_cfg["persist"]
+        if persist and self.index.load(path, self.gallery, self.gallery_ids):
+            return
+        self.index.build(self.gallery, self.gallery_ids)
+        if persist and len(self.gallery):
+            self.index.save(path, self.gallery_ids)
 
     def _load_user_data(self):
         rows = get_all_users()
         for pid, name, _ in rows:
             self.id_to_name[str(pid)] = name
 
-    def recognize(self, frame):
-        faces = self.face_analyzer.get(frame)
-        if not faces:
-            return 0, None, None
-
-        emb = faces[0].embedding.astype(np.float32)
+    @staticmethod
+    def _normalize(emb: np.ndarray) -> np.ndarray:
+        emb = emb.astype(np.float32)
         norm = np.linalg.norm(emb)
-        if norm > 0:
-            emb = emb / norm
+        return emb / norm if norm > 0 else emb
+
+    def face_embedding(self, face) -> np.ndarray:
+        return self._normalize(face.embedding)
+
+    def match(self, emb: np.ndarray):
+        with self._lock:
+            if not len(self.gallery):
+                return None, None
+            rows, sims = self.index.search(emb, 1)
+            if not len(rows):
+                return None, None
+            best_id = self.gallery_ids[rows[0]]
+        # wektory są znormalizowane: ||a - b||^2 = 2 - 2 * <a, b>
+        best_dist = float(np.sqrt(max(2.0 - 2.0 * float(sims[0]), 0.0)))
+        return best_id, best_dist
 
-        best_dist, best_id = float('inf'), None
-        for pid, vecs in self.embeddings_map.items():
-            for v in vecs:
-                d = np.linalg.norm(emb - v)
-                if d < best_dist:
-                    best_dist, best_id = d, pid
+    def _append_rows(self, vecs: np.ndarray, pid: str) -> int:
+        n, k = len(self.gallery), len(vecs)
+        if self._buf is None or n + k > len(self._buf):
+            cap = max(2 * (n + k), 1024)
+            self._buf = np.empty((cap, vecs.shape[1]), dtype=np.float32)
+            self._ids_buf = np.empty(cap, dtype=object)
+            self._buf[:n], self._ids_buf[:n] = self.gallery, self.gallery_ids
+        # wiersze za n nie są widoczne w starych widokach, więc zapis w miejscu jest bezpieczny
+        self._buf[n:n + k] = vecs
+        self._ids_buf[n:n + k] = pid
+        self.gallery, self.gallery_ids = self._buf[:n + k], self._ids_buf[:n + k]
+        return n
 
+    def _remove_rows(self, pid: str) -> bool:
+        if pid not in self.embeddings_map:
+            return False
+        keep = self.gallery_ids != pid
+        self.gallery = np.ascontiguousarray(self.gallery[keep])
+        self.gallery_ids = self.gallery_ids[keep]
+        self._buf, self._ids_buf = None, None
+        self.index.remove(keep, self.gallery, self.gallery_ids)
+        self.embeddings_map.pop(pid, None)
+        self.gallery_version += 1
+        return True
+
+    def add_identity(self, pid: str, vectors, name: str = None):
+        """Dodaje (lub podmienia) osobę w galerii bez przeładowania modeli."""
+        vecs = gallery.normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        with self._lock:
+            self._remove_rows(pid)
+            start = self._append_rows(vecs, pid)
+            self.embeddings_map[pid] = self.gallery[start:]
+            self.index.add(self.gallery, self.gallery_ids, start)
+            self.gallery_version += 1
+            if name is not None:
+                self.id_to_name[pid] = name
+
+    def replace_identity(self, pid: str, vectors, name: str = None):
+        self.add_identity(pid, vectors, name)
+
+    def remove_identity(self, pid: str) -> bool:
+        with self._lock:
+            return self._remove_rows(pid)
+
+    def update_identities(self, changes: dict, names: dict = None):
+        """Wiele zmian naraz pod jedną blokadą: {pid: wektory lub None (usuń)}."""
+        names = names or {}
+        with self._lock:
+            for pid, vecs in changes.items():
+                if vecs is None or not len(vecs):
+                    self._remove_rows(pid)
+                else:
+                    self.add_identity(pid, vecs, names.get(pid))
+
+    def new_stream(self, identity_cache: bool = True) -> StreamState:
+        cfg = {key: {**DEFAULT_MODEL_CFG[key], **self.model_cfg[key]}
+               for key in ("adaptive_det", "roi_tracking", "identity_cache")}
+        acfg, tcfg, ccfg = cfg["adaptive_det"], cfg["roi_tracking"], cfg["identity_cache"]
+        det_size = tracker = cache = None
+        if acfg["enabled"]:
+            det_size = AdaptiveDetSize(acfg["sizes"], acfg["min_face_px"], acfg["history"])
+        if tcfg["enabled"]:
+            tracker = RoiTracker(tcfg["expand"], tcfg["full_every"], tcfg["det_size"], tcfg["max_area"])
+        if identity_cache and ccfg["enabled"]:
+            cache = IdentityCache(ccfg["refresh_every"], ccfg["iou"], ccfg["max_score_drop"],
+                                  ccfg["max_scale_change"], ccfg["max_pose_change"])
+        return StreamState(det_size, tracker, cache)
+
+    def _detect_boxes(self, frame, size: int, roi=None):
+        # sama detekcja z rozmiarem wejścia wybranym dla tej klatki,
+        # opcjonalnie tylko w wycinku roi=(x1, y1, x2, y2); współrzędne zawsze w pełnej klatce
+        x0, y0 = (roi[0], roi[1]) if roi else (0, 0)
+        img = frame[roi[1]:roi[3], roi[0]:roi[2]] if roi else frame
+        bboxes, kpss = self.det_model.detect(
+            img, input_size=(size, size), max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            bbox = bboxes[i, 0:4] + np.array([x0, y0, x0, y0], dtype=bboxes.dtype)
+            kps = kpss[i] + np.array([x0, y0], dtype=kpss.dtype) if kpss is not None else None
+            faces.append(Face(bbox=bbox, kps=kps, det_score=bboxes[i, 4]))
+        return faces
+
+    def embed_faces(self, pairs) -> np.ndarray:
+        """Embeddingi dla [(klatka, twarz)] jednym wywołaniem modelu, w kolejności wejścia.
+
+        Twarze mogą pochodzić z różnych klatek; face.embedding jest uzupełniany jak w FaceAnalysis.get.
+        """
+        pairs = list(pairs)
+        if not pairs or self.rec_model is None:
+            return np.empty((0, self.gallery.shape[1]), dtype=np.float32)
+        size = self.rec_model.input_size[0]
+        crops = [face_align.norm_crop(frame, landmark=face.kps, image_size=size) for frame, face in pairs]
+        if self.embedder is not None:
+            feats = self.embedder.embed(crops)
+        else:
+            feats = run_chunked(self.rec_model.get_feat, crops, self.max_batch)
+        for (frame, face), feat in zip(pairs, feats):
+            face.embedding = feat.flatten()
+            # pozostałe moduły (jeśli włączone) nadal per twarz
+            for taskname, model in self.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(frame, face)
+        return feats
+
+    def _locate_full(self, frame, stream: StreamState):
+        ads = stream.det_size
+        if ads is None:
+            return self._detect_boxes(frame, self.model_cfg["det_size"])
+        size = ads.next_size()
+        faces = self._detect_boxes(frame, size)
+        if not faces and size < ads.max_size:
+            # nic na małym wejściu - jeszcze raz w pełnej rozdzielczości, zanim uznamy brak twarzy
+            faces = self._detect_boxes(frame, ads.max_size)
+        ads.update(faces, frame.shape)
+        return faces
+
+    def _locate(self, frame, stream: StreamState):
+        tracker = stream.tracker
+        if tracker is not None:
+            roi = tracker.roi(frame.shape)
+            if roi is not None:
+                faces = self._detect_boxes(frame, tracker.det_size, roi)
+                if faces:
+                    tracker.update(faces, full=False)
+                    return faces
+        faces = self._locate_full(frame, stream)
+        if tracker is not None:
+            tracker.update(faces, full=True)
+        return faces
+
+    def locate(self, frame, stream: StreamState = None):
+        """Sama detekcja (bbox, kps, det_score), bez embeddingów."""
+        if stream is None:
+            return self._detect_boxes(frame, self.model_cfg["det_size"])
+        return self._locate(frame, stream)
+
+    def detect(self, frame, stream: StreamState = None):
+        faces = self.locate(frame, stream)
+        if stream is not None and stream.cache is not None:
+            return stream.cache.resolve(faces, lambda todo: self.embed_faces((frame, f) for f in todo),
+                                        self.gallery_version)
+        self.embed_faces((frame, f) for f in faces)
+        return faces
+
+    def match_batch(self, embs: np.ndarray):
+        """Dopasowanie wielu znormalizowanych wektorów (M, D) naraz -> [(id, dist)]."""
+        with self._lock:
+            rows, sims = self.index.search_batch(np.asarray(embs, dtype=np.float32).reshape(-1, self.gallery.shape[1]))
+            ids = self.gallery_ids
+        dists = np.sqrt(np.maximum(2.0 - 2.0 * sims, 0.0))
+        return [
+            (ids[r], float(d)) if r >= 0 else (None, None)
+            for r, d in zip(rows, dists)
+        ]
+
+    def classify(self, best_id, best_dist):
         if best_id is None:
             return 0, None, None
 
@@ -62,10 +435,44 @@ class FaceEngine:
         else:
             return 2, best_id, best_dist
 
+    def recognize_all(self, faces) -> list:
+        """Wszystkie twarze z klatki; embeddingi bez wyniku z pamięci śladu dopasowane jedną operacją."""
+        results = [None] * len(faces)
+        pending = []
+        for i, face in enumerate(faces):
+            if face.cached_match is not None:
+                # ślad pewnie rozpoznany w poprzednich klatkach
+                results[i] = FaceMatch(face.bbox, *self.classify(*face.cached_match))
+            else:
+                pending.append(i)
+        if pending:
+            embs = np.stack([self.face_embedding(faces[i]) for i in pending])
+            # wersja sprzed dopasowania - zmiana w trakcie unieważni wynik w następnej klatce
+            version = self.gallery_version
+            for i, best in zip(pending, self.match_batch(embs)):
+                state, cid, dist = self.classify(*best)
+                if faces[i].track is not None:
+                    faces[i].track.remember(state, cid, dist, version)
+                results[i] = FaceMatch(faces[i].bbox, state, cid, dist)
+        return results
+
+    def recognize_faces(self, faces):
+        """Jedna osoba na klatkę: największa (najbliższa) twarz, jak w GUI i rejestracji."""
+        if not faces:
+            return 0, None, None
+        m = self.recognize_all([largest_face(faces)])[0]
+        return m.state, m.id, m.dist
+
+    def recognize(self, frame, stream: StreamState = None):
+        return self.recognize_faces(self.detect(frame, stream))
+
+    def recognize_frame(self, frame, stream: StreamState = None) -> list:
+        return self.recognize_all(self.detect(frame, stream))
+
     def get_embedding(self, image: np.ndarray) -> np.ndarray:
-        faces = self.face_analyzer.get(image)
+        faces = self.locate(image)
         if not faces:
             raise ValueError("Brak twarzy na obrazie")
-        emb = faces[0].embedding.astype(np.float32)
-        norm = np.linalg.norm(emb)
-        return emb / norm if norm > 0 else emb
\ No newline at end of file
+        face = largest_face(faces)
+        self.embed_faces([(image, face)])
+        return self.face_embedding(face)
@@ -0,0 +1,136 @@
+import argparse
+import os
+import struct
+import numpy as np
+from pathlib import Path
+
+# Spakowana galeria: nagłówek (64 B) + macierz float32 (N, D) + tabela id (utf-8, '\n')
+GALLERY_FILE = "gallery.fgl"
+MAGIC = b"FIDGAL01"
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = 64
+
+
+def gallery_path(embeddings_dir) -> Path:
+    return Path(embeddings_dir) / GALLERY_FILE
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def load_embeddings_dir(embeddings_dir) -> dict:
+    """Stary układ: embeddings/<pid>/*.npy -> {pid: macierz (k, D)}."""
+    emb_map = {}
+    base = Path(embeddings_dir)
+    if not base.exists():
+        return emb_map
+    for pid_dir in sorted(base.iterdir()):
+        if not pid_dir.is_dir(): continue
+        vecs = [np.load(npf).astype(np.float32).ravel() for npf in sorted(pid_dir.glob('*.npy'))]
+        vecs = [v for v in vecs if np.linalg.norm(v) > 0]
+        if vecs:
+            emb_map[pid_dir.name] = normalize_rows(np.stack(vecs))
+    return emb_map
+
+
+def flatten(emb_map: dict):
+    ids, rows = [], []
+    for pid, vecs in emb_map.items():
+        ids.extend([pid] * len(vecs))
+        rows.append(np.asarray(vecs, dtype=np.float32))
+    if not rows:
+        return np.empty((0, 512), dtype=np.float32), np.empty(0, dtype=object)
+    return np.ascontiguousarray(np.concatenate(rows)), np.array(ids, dtype=object)
+
+
+def group_rows(matrix: np.ndarray, ids: np.ndarray) -> dict:
+    """Widoki na wiersze macierzy pogrupowane po id (wiersze jednej osoby leżą obok siebie)."""
+    emb_map = {}
+    start = 0
+    for i in range(1, len(ids) + 1):
+        if i == len(ids) or ids[i] != ids[start]:
+            pid = ids[start]
+            block = matrix[start:i]
+            emb_map[pid] = np.concatenate([emb_map[pid], block]) if pid in emb_map else block
+            start = i
+    return emb_map
+
+
+def save_gallery(path, matrix: np.ndarray, ids) -> Path:
+    path = Path(path)
+    order = np.argsort(np.asarray(ids, dtype=str), kind="stable")
+    matrix = np.ascontiguousarray(normalize_rows(matrix)[order])
+    ids = [str(ids[i]) for i in order]
+    n, dim = matrix.shape if matrix.size else (0, 512)
+    id_blob = "\n".join(ids).encode("utf-8")
+    ids_offset = HEADER_SIZE + matrix.nbytes
+
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n, dim, ids_offset, len(id_blob)).ljust(HEADER_SIZE, b"\0"))
+        f.write(matrix.tobytes())
+        f.write(id_blob)
+    os.replace(tmp, path)
+    return path
+
+
+def load_gallery(path):
+    """Zwraca (macierz zmapowana w pamięci tylko do odczytu, tablica id)."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"Uszkodzony plik galerii: {path}")
+        magic, n, dim, ids_offset, ids_size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"Nieprawidłowy plik galerii: {path}")
+        f.seek(ids_offset)
+        id_blob = f.read(ids_size)
+    if len(id_blob) != ids_size:
+        raise ValueError(f"Uszkodzony plik galerii: {path}")
+    ids = np.array(id_blob.decode("utf-8").split("\n") if n else [], dtype=object)
+    if len(ids) != n:
+        raise ValueError(f"Uszkodzony plik galerii: {path}")
+    if n == 0:
+        return np.empty((0, dim), dtype=np.float32), ids
+    matrix = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=(n, dim))
+    return matrix, ids
+
+
+def is_stale(path, embeddings_dir, ids=None) -> bool:
+    """Plik jest nieaktualny, gdy katalogi osób zmieniły się po jego zapisie."""
+    path = Path(path)
+    if not path.exists():
+        return True
+    packed_mtime = path.stat().st_mtime
+    dirs = [d for d in Path(embeddings_dir).iterdir() if d.is_dir()]
+    if any(d.stat().st_mtime > packed_mtime for d in dirs):
+        return True
+    if ids is None:
+        ids = load_gallery(path)[1]
+    return set(ids) != {d.name for d in dirs if any(d.glob('*.npy'))}
+
+
+def migrate(embeddings_dir, out=None) -> Path:
+    emb_map = load_embeddings_dir(embeddings_dir)
+    matrix, ids = flatten(emb_map)
+    return save_gallery(out or gallery_path(embeddings_dir), matrix, ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pakuje katalog embeddings/<pid>/*.npy do jednego pliku galerii")
+    parser.add_argument("embeddings_dir", nargs="?", default="embeddings/")
+    parser.add_argument("-o", "--out", default=None)
+    args = parser.parse_args(argv)
+    out = migrate(args.embeddings_dir, args.out)
+    matrix, ids = load_gallery(out)
+    print(f"{out}: {len(set(ids))} persons, {len(ids)} vectors, dim {matrix.shape[1]}")
+
+
+if __name__ == "__main__":
+    main()
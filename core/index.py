@@ -0,0 +1,351 @@
+import hashlib
+import numpy as np
+from pathlib import Path
+
+DEFAULT_INDEX_CFG = {
+    "type": "flat",     # flat | ivf | centroid
+    "nlist": 0,         # liczba list IVF, 0 = sqrt(N)
+    "nprobe": 8,        # ile list przeszukać (recall <-> czas)
+    "train_iters": 10,
+    "prototypes": 1,    # wektory prototypowe na osobę (centroid)
+    "top_n": 8,         # ile osób przechodzi do dokładnego porównania (centroid)
+    "persist": True
+}
+
+
+def fingerprint(ids, data: np.ndarray) -> str:
+    h = hashlib.sha1()
+    for pid in ids:
+        h.update(str(pid).encode("utf-8"))
+        h.update(b"\n")
+    # próbka wierszy zamiast całej macierzy - wystarczy do wykrycia podmiany galerii
+    h.update(np.ascontiguousarray(data[::max(1, len(data) // 64)]).tobytes())
+    return h.hexdigest()
+
+
+def spherical_kmeans(data: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(data)))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # pusty klaster dostaje losowy punkt zamiast zniknąć
+        sums[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class FlatIndex:
+    kind = "flat"
+
+    def __init__(self, **_):
+        self.data = np.empty((0, 512), dtype=np.float32)
+
+    def build(self, data: np.ndarray, ids=None):
+        self.data = data
+
+    def add(self, data: np.ndarray, ids, start: int):
+        """Dołącza wiersze data[start:] (data to nowa, dłuższa macierz galerii)."""
+        self.data = data
+
+    def remove(self, keep: np.ndarray, data: np.ndarray, ids):
+        """keep: maska starych wierszy, data/ids: galeria już po usunięciu."""
+        self.data = data
+
+    def search(self, q: np.ndarray, k: int = 1):
+        if not len(self.data):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        sims = self.data @ q
+        k = min(k, len(sims))
+        if k == 1:
+            top = np.array([int(np.argmax(sims))])
+        else:
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+        return top, sims[top]
+
+    def search_batch(self, queries: np.ndarray):
+        """Najlepszy wiersz dla każdego zapytania (M, D): (rows, sims), -1 gdy brak."""
+        if not len(self.data) or not len(queries):
+            return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), -np.inf, dtype=np.float32)
+        sims = queries @ self.data.T
+        rows = np.argmax(sims, axis=1)
+        return rows, sims[np.arange(len(rows)), rows]
+
+    def _row_groups(self, groups) -> np.ndarray:
+        """Numer listy / osoby dla każdego wiersza; przeliczany tylko gdy zmieni się lista grup."""
+        if getattr(self, "_groups_key", None) is not groups:
+            owner = np.full(len(self.data), -1, dtype=np.int64)
+            for g, rows in enumerate(groups):
+                owner[rows] = g
+            self._groups_key, self._groups_owner = groups, owner
+        return self._groups_owner
+
+    def _rerank_batch(self, queries: np.ndarray, groups, chosen: np.ndarray):
+        """Dokładne dopasowanie paczki zapytań do kandydatów z wybranych grup - jedno mnożenie macierzy.
+
+        chosen: (M, G) maska grup wybranych na etapie zgrubnym dla każdego zapytania.
+        """
+        cand = np.flatnonzero(chosen.any(axis=0))
+        rows = np.concatenate([groups[g] for g in cand]) if len(cand) else np.empty(0, dtype=np.int64)
+        if not len(rows):
+            return FlatIndex.search_batch(self, queries)
+        sims = queries @ np.asarray(self.data[rows]).T
+        sims[~chosen[:, self._row_groups(groups)[rows]]] = -np.inf
+        best = np.argmax(sims, axis=1)
+        out_rows, out_sims = rows[best], sims[np.arange(len(best)), best]
+        # zapytania bez kandydatów (puste listy) - dokładnie po całej galerii
+        empty = ~np.isfinite(out_sims)
+        if empty.any():
+            out_rows[empty], out_sims[empty] = FlatIndex.search_batch(self, queries[empty])
+        return out_rows, out_sims
+
+    def _search_chunked(self, queries: np.ndarray, search, chunk: int = 64):
+        # porcje ograniczają macierz (zapytania x kandydaci)
+        if len(queries) <= chunk:
+            return search(queries)
+        parts = [search(queries[i:i + chunk]) for i in range(0, len(queries), chunk)]
+        return np.concatenate([r for r, _ in parts]), np.concatenate([s for _, s in parts])
+
+    def save(self, path, ids):
+        pass
+
+    def load(self, path, data, ids) -> bool:
+        return False
+
+    def _exact(self, cand: np.ndarray, q: np.ndarray, k: int):
+        sims = self.data[cand] @ q
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return cand[top], sims[top]
+
+
+class IVFIndex(FlatIndex):
+    kind = "ivf"
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, train_iters: int = 10, **_):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.centroids = np.empty((0, 512), dtype=np.float32)
+        self.lists = []
+
+    def build(self, data: np.ndarray, ids=None):
+        self.data = data
+        if not len(data):
+            self.centroids, self.lists = np.empty((0, data.shape[1]), dtype=np.float32), []
+            return
+        nlist = self.nlist or int(np.sqrt(len(data)))
+        # trening na podzbiorze, przypisanie całości
+        rng = np.random.default_rng(0)
+        sample = data
+        if len(data) > 256 * nlist:
+            sample = data[np.sort(rng.choice(len(data), 256 * nlist, replace=False))]
+        self.centroids = spherical_kmeans(np.asarray(sample), nlist, self.train_iters)
+        self._assign()
+
+    def _assign(self):
+        self._set_lists(np.argmax(self.data @ self.centroids.T, axis=1))
+
+    def add(self, data: np.ndarray, ids, start: int):
+        if not len(self.centroids):
+            self.build(data, ids)
+            return
+        self.data = data
+        assign = np.argmax(np.asarray(data[start:]) @ self.centroids.T, axis=1)
+        lists = list(self.lists)
+        for c in np.unique(assign):
+            lists[c] = np.concatenate([lists[c], start + np.flatnonzero(assign == c)])
+        self.lists = lists
+
+    def remove(self, keep: np.ndarray, data: np.ndarray, ids):
+        new_row = np.cumsum(keep) - 1
+        self.data = data
+        self.lists = [new_row[rows[keep[rows]]] for rows in self.lists]
+
+    def _set_lists(self, assign: np.ndarray):
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def search(self, q: np.ndarray, k: int = 1):
+        if not len(self.data):
+            return super().search(q, k)
+        nprobe = max(1, min(self.nprobe, len(self.centroids)))
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        cand = np.concatenate([self.lists[c] for c in probe])
+        if not len(cand):
+            return super().search(q, k)
+        return self._exact(cand, q, k)
+
+    def search_batch(self, queries: np.ndarray):
+        if not len(self.data) or not len(self.centroids) or not len(queries):
+            return super().search_batch(queries)
+        return self._search_chunked(np.asarray(queries, dtype=np.float32), self._search_block)
+
+    def _search_block(self, queries: np.ndarray):
+        # etap zgrubny dla całej paczki naraz, potem wspólne dokładne porównanie
+        nprobe = max(1, min(self.nprobe, len(self.centroids)))
+        coarse = queries @ self.centroids.T
+        probe = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        chosen = np.zeros(coarse.shape, dtype=bool)
+        np.put_along_axis(chosen, probe, True, axis=1)
+        return self._rerank_batch(queries, self.lists, chosen)
+
+    def _params(self) -> list:
+        return [self.nlist, self.train_iters]
+
+    def save(self, path, ids):
+        path = Path(path)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        assign = np.empty(len(self.data), dtype=np.int32)
+        for c, rows in enumerate(self.lists):
+            assign[rows] = c
+        np.savez(tmp, centroids=self.centroids, assign=assign,
+                 fingerprint=np.array(fingerprint(ids, self.data)),
+                 params=np.array(self._params()))
+        tmp.replace(path)
+
+    def load(self, path, data, ids) -> bool:
+        path = Path(path)
+        if not path.exists():
+            return False
+        with np.load(path) as f:
+            if str(f["fingerprint"]) != fingerprint(ids, data) or len(f["assign"]) != len(data):
+                return False
+            # indeks zbudowany przy innym nlist / train_iters w konfiguracji - budujemy od nowa
+            if "params" not in f.files or list(f["params"]) != self._params():
+                return False
+            self.data = data
+            self.centroids = f["centroids"]
+            self._set_lists(f["assign"])
+        return True
+
+
+class CentroidIndex(FlatIndex):
+    """Najpierw prototypy osób, potem dokładne porównanie z wektorami top_n osób."""
+    kind = "centroid"
+
+    def __init__(self, prototypes: int = 1, top_n: int = 8, train_iters: int = 10, **_):
+        super().__init__()
+        self.prototypes = prototypes
+        self.top_n = top_n
+        self.train_iters = train_iters
+        self.proto = np.empty((0, 512), dtype=np.float32)
+        self.proto_owner = np.empty(0, dtype=np.int64)
+        self.members = []
+        self.idents = []
+
+    def build(self, data: np.ndarray, ids=None):
+        self.data = data
+        self.proto, self.proto_owner = self.proto[:0], self.proto_owner[:0]
+        self.members, self.idents = [], []
+        if not len(data) or ids is None:
+            return
+        self._add_rows(np.asarray(ids), 0)
+
+    def _prototypes(self, vecs: np.ndarray) -> np.ndarray:
+        if self.prototypes <= 1:
+            mean = vecs.mean(axis=0)
+            return (mean / (np.linalg.norm(mean) or 1.0))[None, :].astype(np.float32)
+        return spherical_kmeans(vecs, self.prototypes, self.train_iters)
+
+    def _add_rows(self, ids: np.ndarray, start: int):
+        # nowe wiersze grupujemy po osobie; istniejąca osoba dostaje przeliczone prototypy
+        uniq, owner = np.unique(np.asarray(ids[start:], dtype=str), return_inverse=True)
+        slot = {pid: i for i, pid in enumerate(self.idents)}
+        members = list(self.members)
+        keep = np.ones(len(self.proto_owner), dtype=bool)
+        protos, owners = [self.proto], [self.proto_owner]
+        for u, pid in enumerate(uniq):
+            rows = start + np.flatnonzero(owner == u)
+            if pid in slot:
+                ident = slot[pid]
+                rows = np.concatenate([members[ident], rows])
+                keep &= self.proto_owner != ident
+            else:
+                ident = len(members)
+                members.append(None)
+                self.idents.append(pid)
+            members[ident] = rows
+            p = self._prototypes(np.asarray(self.data[rows]))
+            protos.append(p)
+            owners.append(np.full(len(p), ident, dtype=np.int64))
+        protos[0], owners[0] = self.proto[keep], self.proto_owner[keep]
+        self.members = members
+        self.proto = np.ascontiguousarray(np.concatenate(protos), dtype=np.float32)
+        self.proto_owner = np.concatenate(owners)
+
+    def add(self, data: np.ndarray, ids, start: int):
+        self.data = data
+        self._add_rows(np.asarray(ids), start)
+
+    def remove(self, keep: np.ndarray, data: np.ndarray, ids):
+        new_row = np.cumsum(keep) - 1
+        remap = np.full(len(self.members), -1, dtype=np.int64)
+        members, idents = [], []
+        for ident, (pid, rows) in enumerate(zip(self.idents, self.members)):
+            rows = rows[keep[rows]]
+            if len(rows):
+                remap[ident] = len(members)
+                members.append(new_row[rows])
+                idents.append(pid)
+        alive = remap[self.proto_owner] >= 0
+        self.data = data
+        self.members, self.idents = members, idents
+        self.proto = self.proto[alive]
+        self.proto_owner = remap[self.proto_owner[alive]]
+
+    def search(self, q: np.ndarray, k: int = 1):
+        if not len(self.proto):
+            return super().search(q, k)
+        best = np.full(len(self.members), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self.proto_owner, self.proto @ q)
+        top_n = max(1, min(self.top_n, len(best)))
+        short = np.argpartition(-best, top_n - 1)[:top_n]
+        cand = np.concatenate([self.members[i] for i in short])
+        return self._exact(cand, q, k)
+
+    def search_batch(self, queries: np.ndarray):
+        if not len(self.proto) or not len(queries):
+            return super().search_batch(queries)
+        return self._search_chunked(np.asarray(queries, dtype=np.float32), self._search_block)
+
+    def _search_block(self, queries: np.ndarray):
+        # podobieństwo do prototypów całej paczki naraz, najlepszy prototyp per osoba
+        coarse = queries @ self.proto.T
+        best = np.full((len(queries), len(self.members)), -np.inf, dtype=np.float32)
+        for_rows = np.broadcast_to(np.arange(len(queries))[:, None], coarse.shape)
+        np.maximum.at(best, (for_rows, np.broadcast_to(self.proto_owner, coarse.shape)), coarse)
+        top_n = max(1, min(self.top_n, best.shape[1]))
+        short = np.argpartition(-best, top_n - 1, axis=1)[:, :top_n]
+        chosen = np.zeros(best.shape, dtype=bool)
+        np.put_along_axis(chosen, short, True, axis=1)
+        return self._rerank_batch(queries, self.members, chosen)
+
+
+INDEX_TYPES = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+    CentroidIndex.kind: CentroidIndex,
+}
+
+
+def index_path(embeddings_dir, kind: str) -> Path:
+    return Path(embeddings_dir) / f"index.{kind}.npz"
+
+
+def make_index(cfg: dict = None):
+    cfg = {**DEFAULT_INDEX_CFG, **(cfg or {})}
+    kind = cfg.pop("type")
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Nieznany typ indeksu: {kind}")
+    cfg.pop("persist")
+    return INDEX_TYPES[kind](**cfg)
@@ -0,0 +1,36 @@
+import threading
+
+class FrameSlot:
+    """Jednoelementowy bufor "najnowsza wygrywa" między producentem a wolniejszym konsumentem."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+
+    def put(self, item) -> bool:
+        """Zwraca True, gdy slot był pusty, czyli konsumenta trzeba obudzić."""
+        with self._lock:
+            was_empty = self._item is None
+            if not was_empty:
+                self.dropped += 1
+            self._item = item
+            self.submitted += 1
+            return was_empty
+
+    def take(self):
+        with self._lock:
+            item, self._item = self._item, None
+            if item is not None:
+                self.processed += 1
+            return item
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "processed": self.processed
+            }
@@ -0,0 +1,132 @@
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+
+from core.db_utils import get_user_by_id
+
+try:
+    # inotify (Linux) / FSEvents / ReadDirectoryChangesW (watchdog z requirements.txt);
+    # bez pakietu zostaje odpytywanie
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger("faceid.watcher")
+
+
+class _DirtyHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        for attr in ("src_path", "dest_path"):
+            path = getattr(event, attr, None)
+            if path:
+                self.watcher.mark_dirty(path)
+
+
+class GalleryWatcher:
+    """Śledzi embeddings/<pid>/ i przeładowuje w silniku tylko zmienione osoby.
+
+    Zmiana jest stosowana dopiero, gdy katalog osoby nie zmienił się przez jeden
+    interwał - synchronizacja w połowie kopiowania nie trafia do galerii.
+    """
+
+    def __init__(self, engine, embeddings_dir: str, interval: float = 2.0, backend: str = "auto"):
+        self.engine = engine
+        self.base = Path(embeddings_dir).resolve()
+        self.interval = interval
+        self.use_events = backend in ("auto", "inotify") and Observer is not None
+        if backend == "inotify" and Observer is None:
+            log.warning("watchdog not installed, falling back to polling")
+
+        self._sigs = {}
+        self._pending = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def _signature(self, pid: str):
+        d = self.base / pid
+        try:
+            files = [(f.name, f.stat().st_mtime_ns, f.stat().st_size) for f in d.glob("*.npy")]
+        except OSError:
+            return None
+        return tuple(sorted(files)) or None
+
+    def _person_dirs(self):
+        return {d.name for d in self.base.iterdir() if d.is_dir()} if self.base.exists() else set()
+
+    def mark_dirty(self, path):
+        try:
+            rel = Path(path).resolve().relative_to(self.base)
+        except ValueError:
+            return
+        if rel.parts:
+            with self._lock:
+                self._dirty.add(rel.parts[0])
+
+    def start(self):
+        self._sigs = {pid: self._signature(pid) for pid in self._person_dirs()}
+        if self.use_events:
+            self._observer = Observer()
+            self._observer.schedule(_DirtyHandler(self), str(self.base), recursive=True)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self._thread.start()
+        log.info("gallery watcher started (%s)", "events" if self.use_events else "polling")
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                log.exception("gallery reload failed")
+
+    def check(self):
+        if self.use_events:
+            with self._lock:
+                candidates, self._dirty = self._dirty, set()
+        else:
+            candidates = self._person_dirs() | set(self._sigs)
+        candidates |= set(self._pending)
+
+        current = {pid: self._signature(pid) for pid in candidates}
+        changed = {pid for pid, sig in current.items() if sig != self._sigs.get(pid)}
+        ready = {pid for pid in changed if pid in self._pending and self._pending[pid] == current[pid]}
+        self._pending = {pid: current[pid] for pid in changed - ready}
+        if ready:
+            self._apply({pid: current[pid] for pid in ready})
+
+    def _apply(self, sigs: dict):
+        changes, names = {}, {}
+        for pid, sig in sigs.items():
+            vecs = [np.load(self.base / pid / name).astype(np.float32).ravel() for name, _, _ in sig or ()]
+            vecs = [v for v in vecs if np.linalg.norm(v) > 0]
+            changes[pid] = np.stack(vecs) if vecs else None
+            if vecs and pid not in self.engine.id_to_name:
+                name, _ = get_user_by_id(pid)
+                if name is not None:
+                    names[pid] = name
+        self.engine.update_identities(changes, names)
+        self._sigs.update(sigs)
+        for pid, sig in sigs.items():
+            if sig is None:
+                self._sigs.pop(pid, None)
+        log.info("gallery reloaded: %s", ", ".join(sorted(sigs)))
@@ -3,50 +3,65 @@ from PySide6.QtWidgets import (
     QFrame, QPushButton
 )
 from PySide6.QtCore import Qt, QTimer, QObject, Signal, Slot, QThread
-from PySide6.QtGui import QImage, QPixmap, QIcon
+from PySide6.QtGui import QIcon
 
+import logging
+import time
 import numpy as np
 import cv2
-import time
-from pathlib import Path
 
 from core.camera import CameraHandler
-from core.db_utils import update_last_attendance_time
+from core.attendance import AttendanceTracker, AttendanceWriter
+from core.utils import FrameSlot
 from gui.register_face import RegisterFaceWindow
+from gui.video import FrameRenderer
+from gui.photos import PhotoCache
+
+log = logging.getLogger("faceid.gui")
 
 class RecognitionWorker(QObject):
-    recognized = Signal(int, str, float, float)  # state, id, dist, ts
+    recognized = Signal(int, str, float, float, object)  # state, id, dist, ts, [FaceMatch]
 
-    def __init__(self, engine, cooldown: int):
+    def __init__(self, engine, cooldown: int, attendance: AttendanceWriter):
         super().__init__()
         self.engine = engine
-        self.cooldown = cooldown
-        self.current_id = None
-        self.last_absence = None
+        self.attendance = attendance
+        self.stream = engine.new_stream()
+        self.tracker = AttendanceTracker(cooldown)
         self.last_update_ts = None
+        # ograniczony bufor: worker zawsze bierze najnowszą klatkę, starsze przepadają
+        self.slot = FrameSlot()
+        self.stats_interval = 60.0
+        self._last_stats = time.monotonic()
+
+    def submit(self, frame) -> bool:
+        return self.slot.put(frame)
+
+    @Slot()
+    def process_pending(self):
+        frame = self.slot.take()
+        if frame is None:
+            return
+        self.process_frame(frame)
+        now = time.monotonic()
+        if now - self._last_stats >= self.stats_interval:
+            self._last_stats = now
+            log.info("recognition frames: %s", self.slot.stats())
 
-    @Slot(object)
     def process_frame(self, frame):
-        state, cid, dist = self.engine.recognize(frame)
-        now = time.time()
-        do_update = False
-        if state == 1:
-            if cid != self.current_id and (
-               self.last_absence is None or now - self.last_absence >= self.cooldown):
-                do_update = True
-                self.current_id = cid
-                self.last_absence = None
-        elif state == 0 and self.current_id is not None:
-            self.last_absence = now
-            self.current_id = None
-
-        if do_update:
-            ts = update_last_attendance_time(cid)
-            self.last_update_ts = time.mktime(ts.timetuple())
-        self.recognized.emit(state, cid or "", dist or 0.0, self.last_update_ts or 0.0)
+        # jedna detekcja na klatkę - wynik służy i do rozpoznania, i do ramki w podglądzie
+        faces = self.engine.detect(frame, self.stream)
+        results = self.engine.recognize_all(faces)
+        for pid in self.tracker.update([r.id for r in results if r.state == 1]):
+            # zapis do bazy robi AttendanceWriter w tle
+            self.last_update_ts = self.attendance.submit(pid).timestamp()
+        # prawy panel pokazuje największą (najbliższą) twarz
+        primary = max(results, key=lambda r: r.area) if results else None
+        state, cid, dist = (primary.state, primary.id, primary.dist) if primary else (0, None, None)
+        self.recognized.emit(state, cid or "", dist or 0.0, self.last_update_ts or 0.0, results)
 
 class MainWindow(QMainWindow):
-    frame_ready = Signal(object)
+    frame_ready = Signal()
 
     def __init__(self, config, engine):
         super().__init__()
@@ -56,18 +71,22 @@ class MainWindow(QMainWindow):
         self.engine = engine
         self.id_to_name = engine.id_to_name
         self.update_cooldown = 30
+        self.footer_interval_ms = 250
+        self._shown = {}
+        self._last_results = []
 
-        sample_dir = Path(self.cfg['paths']['sample'])
-        self.unknown_pix = QPixmap(str(sample_dir / 'unknown.jpg'))
-        self.none_pix = QPixmap(str(sample_dir / 'none.jpg'))
-
-        self.camera = CameraHandler(width=1280, height=960)
+        self.camera = CameraHandler(width=1280, height=960, threaded=True)
+        self._last_seq = 0
+        self._disp = None
         self.video_label = QLabel(self)
+        self._renderer = FrameRenderer(self.video_label)
 
         self.photo_label = QLabel(self)
         self.photo_label.setFixedSize(525, 700)
         self.photo_label.setStyleSheet('background: black;')
         self.photo_label.setAlignment(Qt.AlignCenter)
+        # zdjęcia osób już w rozmiarze panelu - podmiana pixmapy bez dekodowania JPEG co klatkę
+        self.photos = PhotoCache(self.cfg['paths']['sample'], self.photo_label.size(), **self.cfg['photo_cache'])
 
         self.caption_label = QLabel(self)
         self.value_label = QLabel(self)
@@ -100,14 +119,23 @@ class MainWindow(QMainWindow):
 
         self._build_ui()
 
+        self.attendance = AttendanceWriter(**self.cfg['attendance'])
+        self.attendance.start()
+
         # worker thread
         self._recog_thread = QThread(self)
-        self._recog_worker = RecognitionWorker(self.engine, self.update_cooldown)
+        self._recog_worker = RecognitionWorker(self.engine, self.update_cooldown, self.attendance)
         self._recog_worker.moveToThread(self._recog_thread)
-        self.frame_ready.connect(self._recog_worker.process_frame, Qt.QueuedConnection)
+        self.frame_ready.connect(self._recog_worker.process_pending, Qt.QueuedConnection)
         self._recog_worker.recognized.connect(self._on_recognized)
         self._recog_thread.start()
 
+        self._footer_pending = None
+        self._footer_timer = QTimer(self)
+        self._footer_timer.setSingleShot(True)
+        self._footer_timer.setInterval(self.footer_interval_ms)
+        self._footer_timer.timeout.connect(self._flush_footer)
+
         # timer
         self.timer = QTimer(self)
         self.timer.timeout.connect(self._on_frame)
@@ -209,57 +237,78 @@ class MainWindow(QMainWindow):
         main.addWidget(self.footer_label)
 
     def _on_frame(self):
-        ret, frame = self.camera.read()
-        if not ret: return
-        faces = self.engine.face_analyzer.get(frame)
-        disp = frame.copy()
-        if faces:
-            x1,y1,x2,y2 = faces[0].bbox.astype(int)
-            cv2.rectangle(disp,(x1,y1),(x2,y2),(0,255,0),2)
-        rgb = disp[:,:,::-1]
-        rgb = np.ascontiguousarray(rgb)
-        h,w,_ = rgb.shape
-        bpl = rgb.strides[0]
-        img = QImage(rgb.data,w,h,bpl,QImage.Format_RGB888)
-        pix = QPixmap.fromImage(img).scaled(
-            self.video_label.size(),Qt.KeepAspectRatio,Qt.SmoothTransformation
-        )
-        self.video_label.setPixmap(pix)
-
-        self.frame_ready.emit(frame.copy())
-
-    @Slot(int,str,float,float)
-    def _on_recognized(self,state,cid,dist,ts):
+        ret, frame, _, seq = self.camera.latest()
+        if not ret or seq == self._last_seq: return
+        self._last_seq = seq
+        # klatka z kamery jest tylko do odczytu - ramki rysujemy na własnym, ponownie używanym buforze
+        disp = frame
+        if self._last_results:
+            if self._disp is None or self._disp.shape != frame.shape:
+                self._disp = np.empty_like(frame)
+            np.copyto(self._disp, frame)
+            disp = self._disp
+            for r in self._last_results:
+                x1,y1,x2,y2 = r.bbox.astype(int)
+                color = (0,255,0) if r.state == 1 else (0,165,255)
+                cv2.rectangle(disp,(x1,y1),(x2,y2),color,2)
+        # BGR bez odwracania kanałów; skalowanie tylko gdy klatka nie ma rozmiaru podglądu
+        self._renderer.show(disp)
+
+        # sygnał tylko gdy slot był pusty - kolejka Qt nie rośnie, gdy worker nie nadąża;
+        # worker dostaje tę samą (niezmienną) klatkę, bez kopii
+        if self._recog_worker.submit(frame):
+            self.frame_ready.emit()
+
+    @Slot(int,str,float,float,object)
+    def _on_recognized(self,state,cid,dist,ts,results):
+        self._last_results = results
+        # pozostałe twarze w kadrze mogą za chwilę stać się główną - ich zdjęcia wczytujemy w tle
+        self.photos.prefetch({r.id for r in results if r.id and r.id != cid})
         if state==0:
-            self.photo_label.setPixmap(self.none_pix.scaled(
-                self.photo_label.size(),Qt.KeepAspectRatio,Qt.SmoothTransformation))
-            self.value_label.setText('[Face is not detected]')
-            self.id_value.setText('[Face is not detected]')
+            name=ident='[Face is not detected]'
             best='N/A'
         elif state==2:
-            self.photo_label.setPixmap(self.unknown_pix.scaled(
-                self.photo_label.size(),Qt.KeepAspectRatio,Qt.SmoothTransformation))
-            self.value_label.setText('[Unknown Face]')
-            self.id_value.setText(f"[Unknown Face]")
+            name=ident='[Unknown Face]'
             best=cid
         else:
-            sample_dir=Path(self.cfg['paths']['sample'])
-            img_path=sample_dir/f"{cid}.jpg"
-            pix=QPixmap(str(img_path)) if img_path.exists() else self.none_pix
-            self.photo_label.setPixmap(pix.scaled(
-                self.photo_label.size(),Qt.KeepAspectRatio,Qt.SmoothTransformation))
             name=self.id_to_name.get(cid,'[Unknown]')
-            self.value_label.setText(name)
-            self.id_value.setText(f'{cid}')
+            ident=f'{cid}'
             best=name
 
-        self.register_button.setEnabled(state == 2)
+        # widżety ruszamy tylko gdy zmienia się to, co faktycznie wyświetlają
+        photo=(state,cid if state==1 else None)
+        if self._shown.get('photo')!=photo:
+            self._shown['photo']=photo
+            if state==0: pix=self.photos.none_pix
+            elif state==2: pix=self.photos.unknown_pix
+            else: pix=self.photos.get(cid)
+            self.photo_label.setPixmap(pix)
+        for key,label,text in (('name',self.value_label,name),('id',self.id_value,ident)):
+            if self._shown.get(key)!=text:
+                self._shown[key]=text
+                label.setText(text)
+        if self._shown.get('button')!=(state==2):
+            self._shown['button']=state==2
+            self.register_button.setEnabled(state==2)
+
         fd='True' if state!=0 else 'False'
         d_txt=f"{dist:.2f}" if state>0 else 'N/A'
-        self.footer_label.setText(
+        self._set_footer(
             f"Sebastian Olszak - Projekt pracy inżynierskiej | FACEID | Face_Detected: {fd} | Best: {best} | Distance: {d_txt}"
         )
 
+    def _set_footer(self,text):
+        self._footer_pending=text
+        if not self._footer_timer.isActive():
+            self._flush_footer()
+
+    def _flush_footer(self):
+        # najwyżej jedno odświeżenie stopki na footer_interval_ms; ostatnia wartość zawsze trafia na ekran
+        text=self._footer_pending
+        if text is not None and text!=self.footer_label.text():
+            self.footer_label.setText(text)
+            self._footer_timer.start()
+
     def open_register_window(self):
         self.setEnabled(False)
         self.timer.stop()
@@ -272,4 +321,12 @@ class MainWindow(QMainWindow):
     def _on_register_closed(self, result=None):
         self.setEnabled(True)
         self.camera.open()
-        self.timer.start(30)
\ No newline at end of file
+        self.timer.start(30)
+
+    def closeEvent(self, ev):
+        self.timer.stop(); self.camera.close()
+        self._recog_thread.quit(); self._recog_thread.wait()
+        log.info("recognition frames: %s", self._recog_worker.slot.stats())
+        self.attendance.stop()
+        self.photos.close()
+        super().closeEvent(ev)
\ No newline at end of file
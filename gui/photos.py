@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PySide6.QtCore import Qt, QSize
+from PySide6.QtGui import QImage, QPixmap
+
+class PhotoCache:
+    """Zdjęcia osób z sample/ już przeskalowane do rozmiaru panelu, LRU z limitem w MB.
+
+    Dekodowanie i skalowanie w tle robi się na QImage (QPixmap tylko w wątku GUI);
+    gotowe obrazy trafiają do cache przy następnym wywołaniu z wątku GUI.
+    """
+
+    def __init__(self, sample_dir, size: QSize, max_mb: int = 64, prefetch: bool = True):
+        self.sample_dir = Path(sample_dir)
+        self.size = size
+        self.max_bytes = max_mb * 1024 * 1024
+        self.bytes = 0
+        self._cache = OrderedDict()  # pid -> (QPixmap, koszt w bajtach)
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._ready = {}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-prefetch") if prefetch else None
+
+        # stałe obrazy poza LRU
+        self.none_pix = self._to_pixmap(self._load(self.sample_dir / "none.jpg"))
+        self.unknown_pix = self._to_pixmap(self._load(self.sample_dir / "unknown.jpg"))
+
+    def _load(self, path):
+        img = QImage(str(path))
+        if img.isNull():
+            return None
+        return img.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    @staticmethod
+    def _to_pixmap(img):
+        return QPixmap.fromImage(img) if img is not None else QPixmap()
+
+    def _put(self, pid, img):
+        if img is None:
+            # brak zdjęcia też zapamiętujemy, żeby nie sprawdzać dysku co klatkę
+            self._cache[pid] = (self.none_pix, 0)
+            return self.none_pix
+        pix = QPixmap.fromImage(img)
+        cost = pix.width() * pix.height() * pix.depth() // 8
+        self._cache[pid] = (pix, cost)
+        self.bytes += cost
+        while self.bytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, old) = self._cache.popitem(last=False)
+            self.bytes -= old
+        return pix
+
+    def _drain(self):
+        with self._lock:
+            ready, self._ready = self._ready, {}
+            self._queued.difference_update(ready)
+        for pid, img in ready.items():
+            if pid not in self._cache:
+                self._put(pid, img)
+
+    def get(self, pid) -> QPixmap:
+        self._drain()
+        hit = self._cache.get(pid)
+        if hit is not None:
+            self._cache.move_to_end(pid)
+            return hit[0]
+        return self._put(pid, self._load(self.sample_dir / f"{pid}.jpg"))
+
+    def prefetch(self, pids):
+        """Wczytuje w tle zdjęcia kandydatów, zanim staną się główną twarzą w panelu."""
+        if self._pool is None:
+            return
+        self._drain()
+        for pid in pids:
+            with self._lock:
+                if pid in self._cache or pid in self._queued:
+                    continue
+                self._queued.add(pid)
+            self._pool.submit(self._prefetch_one, pid)
+
+    def _prefetch_one(self, pid):
+        img = self._load(self.sample_dir / f"{pid}.jpg")
+        with self._lock:
+            self._ready[pid] = img
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
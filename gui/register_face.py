@@ -1,21 +1,90 @@
 from PySide6.QtWidgets import (
     QDialog, QWidget, QLabel, QLineEdit, QPushButton,
     QListWidget, QListWidgetItem, QAbstractItemView,
-    QVBoxLayout, QHBoxLayout, QFrame, QApplication, QMessageBox
+    QVBoxLayout, QHBoxLayout, QFrame, QApplication, QMessageBox, QProgressDialog
 )
-from PySide6.QtCore import Qt, QTimer, QRect, QEvent, QSize
-from PySide6.QtGui import QImage, QPixmap, QIcon, QPainter, QPen, QColor
+from PySide6.QtCore import Qt, QTimer, QRect, QEvent, QSize, QObject, Signal, Slot, QThread
+from PySide6.QtGui import QIcon, QPainter, QPen, QColor
 
 
+import cv2
 import numpy as np
 from pathlib import Path
 from core.camera import CameraHandler
+from core.engine import largest_face
+from gui.video import FrameRenderer
+
+class CapturedPhoto:
+    """Zdjęcie z chwili "Take Photo": surowa klatka i wynik detekcji z tej samej klatki."""
+    __slots__ = ("frame", "bbox", "kps", "embedding", "thumb")
+
+    def __init__(self, frame, bbox=None, kps=None, embedding=None, thumb=None):
+        self.frame = frame
+        self.bbox = bbox
+        self.kps = kps
+        self.embedding = embedding
+        self.thumb = thumb
+
+class RegistrationWorker(QObject):
+    """Zapis rejestracji poza wątkiem GUI: embeddingi, zdjęcie, wpis w bazie, galeria silnika."""
+    progress = Signal(int, int)  # done, total
+    finished = Signal(str, str)  # id, name
+    failed = Signal(str)
+
+    def __init__(self, engine, cfg, name, photos, main_index):
+        super().__init__()
+        self.engine = engine
+        self.cfg = cfg
+        self.name = name
+        self.photos = photos  # [CapturedPhoto]
+        self.main_index = main_index
+
+    @Slot()
+    def run(self):
+        import uuid
+        from datetime import datetime, timezone
+        from core.db_utils import create_person
+
+        embeddings = [p.embedding for p in self.photos]
+        total = len(embeddings) + 3
+        done = 0
+        try:
+            new_id = str(uuid.uuid4())
+            emb_dir = Path(self.cfg['paths']['embeddings']) / new_id
+            emb_dir.mkdir(parents=True, exist_ok=True)
+            for idx, embedding in enumerate(embeddings):
+                np.save(emb_dir / f"{idx}.npy", embedding)
+                done += 1
+                self.progress.emit(done, total)
+
+            sample_dir = Path(self.cfg['paths']['sample'])
+            sample_dir.mkdir(parents=True, exist_ok=True)
+            # pełna rozdzielczość z kamery, bez skalowania podglądu i ramki
+            cv2.imwrite(str(sample_dir / f"{new_id}.jpg"), self.photos[self.main_index].frame)
+            done += 1
+            self.progress.emit(done, total)
+
+            create_person(new_id, self.name, datetime.now(timezone.utc))
+            done += 1
+            self.progress.emit(done, total)
+
+            # od razu rozpoznawalny, bez restartu aplikacji
+            self.engine.add_identity(new_id, embeddings, self.name)
+            done += 1
+            self.progress.emit(done, total)
+        except Exception as e:
+            # każdy błąd kończy się sygnałem - dialog postępu musi się zamknąć
+            self.failed.emit(str(e) or type(e).__name__)
+            return
+        self.finished.emit(new_id, self.name)
 
 class RegisterFaceWindow(QDialog):
     def __init__(self, config, engine, parent=None):
         super().__init__(parent)
         self.engine = engine
         self.cfg = config
+        # bez pamięci tożsamości - każde zdjęcie musi mieć własny embedding
+        self.stream = engine.new_stream(identity_cache=False)
 
         self.setWindowFlags(
             Qt.Window
@@ -29,10 +98,13 @@ class RegisterFaceWindow(QDialog):
         self.setWindowIcon(QIcon(":/icon.png"))
         QTimer.singleShot(0, self._force_maximize)
 
-        self.camera = CameraHandler(width=1280, height=960)
+        self.camera = CameraHandler(width=1280, height=960, threaded=True)
+        self._last_seq = 0
+        self._disp = None
         self.video_label = QLabel(self)
         self.video_label.setFixedSize(1280, 960)
         self.video_label.setAlignment(Qt.AlignCenter)
+        self._renderer = FrameRenderer(self.video_label)
 
         self.snap_btn = QPushButton("Take Photo", self)
         self.snap_btn.setEnabled(False)  # tylko gdy twarz
@@ -124,7 +196,10 @@ class RegisterFaceWindow(QDialog):
         content.addWidget(self.right_frame,2)
         self.layout().addLayout(content); self.layout().addWidget(self.footer_label)
 
+        # _temp_photos: CapturedPhoto; _last_capture / _last_face: bieżąca klatka z twarzą (bez embeddingu)
         self._temp_photos, self._main_photo_index = [], None
+        self._last_capture = self._last_face = None
+        self._reg_thread = None
 
         self.timer=QTimer(self); self.timer.timeout.connect(self._on_frame)
         self.camera.open(); self.timer.start(30)
@@ -134,33 +209,45 @@ class RegisterFaceWindow(QDialog):
         self.setGeometry(geom)
 
     def _on_frame(self):
-        ret, frame = self.camera.read()
-        if not ret: return
-        faces = self.engine.face_analyzer.get(frame)
-        disp = frame.copy()
-        # ramka na podgląd
+        ret, frame, _, seq = self.camera.latest()
+        if not ret or seq == self._last_seq: return
+        self._last_seq = seq
+        # w podglądzie tylko detekcja; embedding dopiero po "Take Photo"
+        faces = self.engine.locate(frame, self.stream)
+        disp = frame
+        # ramka na podgląd - na własnym buforze, klatka z kamery jest tylko do odczytu
         if faces:
-            x1,y1,x2,y2 = faces[0].bbox.astype(int)
-            import cv2
+            if self._disp is None or self._disp.shape != frame.shape:
+                self._disp = np.empty_like(frame)
+            np.copyto(self._disp, frame)
+            disp = self._disp
+            # osoba rejestrowana to największa twarz, nie pierwsza w kolejności detektora
+            face = largest_face(faces)
+            x1,y1,x2,y2 = face.bbox.astype(int)
             cv2.rectangle(disp,(x1,y1),(x2,y2),(0,255,0),2)
             self.snap_btn.setEnabled(True)
+            self._last_capture = CapturedPhoto(frame, face.bbox.astype(np.float32), face.kps)
+            self._last_face = face
         else:
             self.snap_btn.setEnabled(False)
-        rgb=disp[:,:,::-1]; rgb=np.ascontiguousarray(rgb)
-        h,w,_=rgb.shape; bpl=rgb.strides[0]
-        img=QImage(rgb.data,w,h,bpl,QImage.Format_RGB888)
-        pix=QPixmap.fromImage(img).scaled(self.video_label.size(),
-                                          Qt.KeepAspectRatio,Qt.SmoothTransformation)
-        self.video_label.setPixmap(pix)
+            self._last_capture = self._last_face = None
+        self._renderer.show(disp)
 
     def _take_photo(self):
         pix=self.video_label.pixmap()
-        if pix: self._add_photo(pix)
-
-    def _add_photo(self,pixmap):
-        item=QListWidgetItem(); item.setIcon(QIcon(pixmap))
-        item.setData(Qt.UserRole,pixmap)
-        self.photo_list.addItem(item); self._temp_photos.append(pixmap)
+        cap = self._last_capture
+        if pix and cap:
+            # jedno rozpoznanie na zdjęcie, z klatki i punktów z detekcji - bez ponownej detekcji
+            self.engine.embed_faces([(cap.frame, self._last_face)])
+            embedding = self.engine.face_embedding(self._last_face)
+            # do listy tylko miniatura; zapis idzie z surowej klatki
+            thumb = pix.scaled(256, 256, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self._add_photo(CapturedPhoto(cap.frame, cap.bbox, cap.kps, embedding, thumb))
+
+    def _add_photo(self,photo):
+        item=QListWidgetItem(); item.setIcon(QIcon(photo.thumb))
+        item.setData(Qt.UserRole,photo.thumb)
+        self.photo_list.addItem(item); self._temp_photos.append(photo)
         self._refresh_photo_list()
 
     def _refresh_photo_list(self):
@@ -198,38 +285,42 @@ class RegisterFaceWindow(QDialog):
         self.register_btn.setEnabled(ok)
 
     def _on_register(self):
-        import uuid
-        from datetime import datetime, timezone
-        import numpy as np
-
-        new_id = str(uuid.uuid4())
-        name = self.name_input.text().strip()
-        now = datetime.now(timezone.utc)
-
-        from pathlib import Path
-        emb_dir = Path(self.cfg['paths']['embeddings']) / new_id
-        emb_dir.mkdir(parents=True, exist_ok=True)
-
-        for idx, pixmap in enumerate(self._temp_photos):
-            img = pixmap.toImage().convertToFormat(QImage.Format_RGB888)
-            ptr = img.bits()
-            bpl = img.bytesPerLine()
-            h = img.height()
-            total = bpl * h
-            buffer = ptr[:total]
-            arr = np.frombuffer(buffer, dtype=np.uint8).reshape(h, img.width(), 3)
-            embedding = self.engine.get_embedding(arr)
-            # zapis
-            np.save(emb_dir / f"{idx}.npy", embedding)
-
-        sample_dir = Path(self.cfg['paths']['sample'])
-        sample_dir.mkdir(parents=True, exist_ok=True)
-        main_pix = self._temp_photos[self._main_photo_index]
-        main_pix.save(str(sample_dir / f"{new_id}.jpg"))
-
-        from core.db_utils import create_person
-        create_person(new_id, name, now)
+        self.register_btn.setEnabled(False)
+        self.timer.stop()
+
+        photos = list(self._temp_photos)
+        self._progress = QProgressDialog("Saving registration...", None, 0, len(photos) + 3, self)
+        self._progress.setWindowModality(Qt.WindowModal)
+        self._progress.setMinimumDuration(0)
+
+        # embeddingi są z chwili zrobienia zdjęcia; w tle zostaje zapis plików, baza i galeria
+        self._reg_thread = QThread(self)
+        self._reg_worker = RegistrationWorker(self.engine, self.cfg, self.name_input.text().strip(),
+                                              photos, self._main_photo_index)
+        self._reg_worker.moveToThread(self._reg_thread)
+        self._reg_thread.started.connect(self._reg_worker.run)
+        self._reg_worker.progress.connect(self._on_register_progress)
+        self._reg_worker.finished.connect(self._finish_register)
+        self._reg_worker.failed.connect(self._on_register_failed)
+        self._reg_worker.finished.connect(self._reg_thread.quit)
+        self._reg_worker.failed.connect(self._reg_thread.quit)
+        self._reg_thread.start()
+
+    @Slot(int, int)
+    def _on_register_progress(self, done, total):
+        self._progress.setMaximum(total)
+        self._progress.setValue(done)
+
+    @Slot(str)
+    def _on_register_failed(self, msg):
+        self._progress.close()
+        QMessageBox.warning(self, "Registration failed", msg)
+        self.timer.start(30)
+        self._update_register_enabled()
 
+    @Slot(str, str)
+    def _finish_register(self, new_id, name):
+        self._progress.close()
         QMessageBox.information(
             self, "Registered",
             f"User {name}\nID: {new_id}\nwas registered successfully."
@@ -244,4 +335,6 @@ class RegisterFaceWindow(QDialog):
 
     def closeEvent(self,ev):
         self.timer.stop(); self.camera.close()
+        if self._reg_thread is not None:
+            self._reg_thread.quit(); self._reg_thread.wait()
         super().closeEvent(ev)
@@ -0,0 +1,43 @@
+from PySide6.QtCore import Qt, QSize
+from PySide6.QtGui import QImage, QPixmap
+
+import cv2
+import numpy as np
+
+class FrameRenderer:
+    """Klatka BGR -> QPixmap w rozmiarze etykiety podglądu (KeepAspectRatio).
+
+    Gdy klatka ma już rozmiar docelowy, nie ma żadnego skalowania; w przeciwnym razie
+    cv2.resize do ponownie używanego bufora zamiast QPixmap.scaled na każdej klatce.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self._key = None
+        self._size = None
+        self._buf = None
+
+    def _target(self, w, h):
+        key = (w, h, self.label.width(), self.label.height())
+        if key != self._key:
+            self._key = key
+            size = QSize(w, h).scaled(self.label.size(), Qt.KeepAspectRatio)
+            self._size = (max(1, size.width()), max(1, size.height()))
+            self._buf = None
+        return self._size
+
+    def to_pixmap(self, frame) -> QPixmap:
+        h, w = frame.shape[:2]
+        tw, th = self._target(w, h)
+        if (tw, th) != (w, h):
+            if self._buf is None:
+                self._buf = np.empty((th, tw, frame.shape[2]), dtype=frame.dtype)
+            interp = cv2.INTER_AREA if tw < w else cv2.INTER_LINEAR
+            cv2.resize(frame, (tw, th), dst=self._buf, interpolation=interp)
+            frame = self._buf
+        # QPixmap.fromImage kopiuje piksele, więc bufor można nadpisać przy następnej klatce
+        img = QImage(frame.data, tw, th, frame.strides[0], QImage.Format_BGR888)
+        return QPixmap.fromImage(img)
+
+    def show(self, frame):
+        self.label.setPixmap(self.to_pixmap(frame))
@@ -0,0 +1,166 @@
+import argparse
+import json
+import logging
+import signal
+import sys
+import time
+from pathlib import Path
+
+from core.attendance import AttendanceTracker, AttendanceWriter
+from core.camera import CameraHandler
+from core.config import load_config
+from core.db_utils import init_db_pool, close_pool
+from core.engine import FaceEngine
+from core.watcher import GalleryWatcher
+
+log = logging.getLogger("faceid.headless")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {"ts": round(record.created, 3), "level": record.levelname, "msg": record.getMessage()}
+        event.update(getattr(record, "event", {}))
+        return json.dumps(event, ensure_ascii=False)
+
+
+def setup_logging(log_file: str):
+    handler = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def parse_source(src):
+    # "0" -> indeks kamery, cokolwiek innego -> plik / URL strumienia
+    if isinstance(src, str) and src.isdigit():
+        return int(src)
+    return src
+
+
+class SourceRunner:
+    def __init__(self, name, source, width, height, cooldown, stream):
+        self.name = name
+        self.stream = stream
+        source = parse_source(source)
+        # plik wideo czytamy po kolei (każda klatka, koniec przy EOF);
+        # kamera / URL w wątku z najnowszą klatką i ponownym łączeniem po utracie
+        self.is_file = isinstance(source, str) and Path(source).is_file()
+        self.camera = CameraHandler(source, width=width, height=height, threaded=not self.is_file)
+        self.tracker = AttendanceTracker(cooldown)
+        self.last_seq = 0
+        self.last_key = None
+        self.done = False
+
+    def _next_frame(self):
+        if not self.is_file:
+            return self.camera.latest()
+        ret, frame = self.camera.read()
+        if not ret:
+            self.done = True
+            log.info("source ended", extra={"event": {"source": self.name, "frames": self.last_seq}})
+            return False, None, 0.0, self.last_seq
+        return True, frame, time.time(), self.last_seq + 1
+
+    def step(self, engine, attendance):
+        ret, frame, ts, seq = self._next_frame()
+        if not ret or seq == self.last_seq:
+            return False
+        self.last_seq = seq
+        results = engine.recognize_frame(frame, self.stream)
+
+        key = sorted((r.state, r.id if r.state == 1 else "") for r in results)
+        if key != self.last_key:
+            self.last_key = key
+            log.info("recognition", extra={"event": {
+                "source": self.name, "frame_ts": round(ts, 3), "seq": seq,
+                "faces": [{
+                    "state": r.state, "id": r.id,
+                    "name": engine.id_to_name.get(r.id) if r.id else None,
+                    "dist": round(r.dist, 4) if r.dist is not None else None,
+                    "bbox": [int(v) for v in r.bbox]
+                } for r in results]
+            }})
+
+        for pid in self.tracker.update([r.id for r in results if r.state == 1]):
+            new_ts = attendance.submit(pid)
+            log.info("attendance", extra={"event": {
+                "source": self.name, "id": pid,
+                "attendance_time": new_ts.isoformat()
+            }})
+        return True
+
+
+def run(config, sources):
+    hcfg = config["headless"]
+    engine = FaceEngine(
+        embeddings_dir=config["paths"]["embeddings"],
+        threshold=config["threshold"],
+        index_cfg=config["index"],
+        model_cfg=config["models"],
+        runtime_cfg=config["runtime"]
+    )
+    runners = [
+        SourceRunner(str(src), src, hcfg["width"], hcfg["height"], hcfg["cooldown"], engine.new_stream())
+        for src in sources
+    ]
+    attendance = AttendanceWriter(**config["attendance"])
+    attendance.start()
+    watcher = None
+    wcfg = config["watcher"]
+    if wcfg["enabled"]:
+        watcher = GalleryWatcher(engine, config["paths"]["embeddings"], wcfg["interval"], wcfg["backend"])
+        watcher.start()
+    for r in runners:
+        r.camera.open()
+        log.info("source opened", extra={"event": {"source": r.name}})
+
+    running = True
+
+    def stop(*_):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    interval = hcfg["interval_ms"] / 1000.0
+    try:
+        while running:
+            active = [r for r in runners if not r.done]
+            if not active:
+                log.info("all sources ended")
+                break
+            busy = False
+            for r in active:
+                busy = r.step(engine, attendance) or busy
+            if not busy:
+                time.sleep(interval)
+    finally:
+        for r in runners:
+            r.camera.close()
+        if watcher:
+            watcher.stop()
+        attendance.stop()
+        log.info("stopped", extra={"event": {"attendance_written": attendance.written,
+                                             "attendance_spilled": attendance.spilled}})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FACEID - rozpoznawanie bez GUI")
+    parser.add_argument("-s", "--source", action="append",
+                        help="indeks kamery, plik wideo lub URL (można podać wielokrotnie)")
+    parser.add_argument("--log", default=None, help="plik logu JSONL (domyślnie stdout)")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    setup_logging(args.log if args.log is not None else config["headless"]["log_file"])
+    init_db_pool(minconn=1, maxconn=4, dsn=config["db_conn"])
+    try:
+        run(config, args.source or config["headless"]["sources"])
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
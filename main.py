@@ -1,20 +1,31 @@
 import sys
+import logging
 from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import Qt
 from core.config import load_config
 from core.db_utils import init_db_pool
 from core.engine import FaceEngine
+from core.watcher import GalleryWatcher
 from gui.main_window import MainWindow
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
     config = load_config()
     init_db_pool(minconn=2, maxconn=10, dsn=config["db_conn"])
 
     engine = FaceEngine(
         embeddings_dir=config["paths"]["embeddings"],
-        threshold=config["threshold"]
+        threshold=config["threshold"],
+        index_cfg=config["index"],
+        model_cfg=config["models"],
+        runtime_cfg=config["runtime"]
     )
 
+    wcfg = config["watcher"]
+    if wcfg["enabled"]:
+        watcher = GalleryWatcher(engine, config["paths"]["embeddings"], wcfg["interval"], wcfg["backend"])
+        watcher.start()
+
     app = QApplication(sys.argv)
     window = MainWindow(config, engine)
     window.showMaximized()